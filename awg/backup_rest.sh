@@ -77,17 +77,25 @@ else
     exit 1
 fi
 
-# --- Применяем изменения (перезагружаем WireGuard) ---
-echo "\nПытаемся перезагрузить конфигурацию WireGuard внутри контейнера..."
-# Эта команда перезагружает конфигурацию WG. Возможно, потребуется изменить, если ваш контейнер использует другой метод.
+# --- Применяем изменения (без перезапуска интерфейса) ---
+echo "\nПрименяем конфигурацию WireGuard внутри контейнера..."
+# wg syncconf применяет только отличия, поэтому подключённые клиенты не отключаются.
 # Используем 'sh -c' для выполнения нескольких команд и обработки путей с пробелами
-if docker exec "$DOCKER_CONTAINER" sh -c "wg-quick down \"${WG_CONFIG_FILE}\" && wg-quick up \"${WG_CONFIG_FILE}\""; then
-     echo "Конфигурация WireGuard успешно перезагружена."
+WG_INTERFACE=$(basename "$WG_CONFIG_FILE" .conf)
+STRIPPED_CONF="/tmp/${WG_INTERFACE}.stripped.conf"
+if docker exec "$DOCKER_CONTAINER" sh -c "wg-quick strip \"${WG_CONFIG_FILE}\" > \"${STRIPPED_CONF}\" && wg syncconf \"${WG_INTERFACE}\" \"${STRIPPED_CONF}\""; then
+     echo "Конфигурация WireGuard успешно применена."
 else
-     echo "Внимание: Не удалось перезагрузить конфигурацию WireGuard внутри контейнера."
-     echo "Возможно, потребуется вручную перезапустить контейнер или сервис для применения изменений."
-     echo "Команда, которая не выполнилась: docker exec \"$DOCKER_CONTAINER\" sh -c \"wg-quick down \\\"${WG_CONFIG_FILE}\\\" && wg-quick up \\\"${WG_CONFIG_FILE}\\\"\""
+     echo "Внимание: Не удалось применить конфигурацию WireGuard через wg syncconf."
+     echo "Пробуем перезапустить интерфейс (клиенты будут переподключены)..."
+     if docker exec "$DOCKER_CONTAINER" sh -c "wg-quick down \"${WG_CONFIG_FILE}\" && wg-quick up \"${WG_CONFIG_FILE}\""; then
+          echo "Конфигурация WireGuard успешно перезагружена."
+     else
+          echo "Внимание: Не удалось перезагрузить конфигурацию WireGuard внутри контейнера."
+          echo "Возможно, потребуется вручную перезапустить контейнер или сервис для применения изменений."
+     fi
 fi
+docker exec "$DOCKER_CONTAINER" rm -f "$STRIPPED_CONF" || true
 
 
 echo "\nПроцесс замены файлов завершен.\n"
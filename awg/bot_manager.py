@@ -2,8 +2,9 @@ import logging
 import asyncio
 import os
 import sys
+from datetime import datetime
 from service.send_backup_admin import send_backup, send_peak_usage
-from utils import load_isp_cache
+from utils import close_isp_lookup, load_isp_cache
 import db
 from zoneinfo import ZoneInfo
 from aiogram import Router, Dispatcher
@@ -11,9 +12,14 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from service.user_vpn_check import update_vpn_state
 from service.notifier import daily_check_end_date_and_notify
+from service.ssh_pool import ssh_pool
+from service.connection_history import (
+    FLUSH_INTERVAL as CONNECTIONS_FLUSH_INTERVAL,
+    connection_history,
+)
 from handlers import payment, user_actions, start_help, admin_actions, instrustion
 from middlewares.admin_delete import AdminMessageDeletionMiddleware
-from settings import BOT, ADMINS, check_environment
+from settings import BOT, ADMINS, CONNECTIONS_RETENTION_DAYS, check_environment
 
 
 # ⚙️ Логирование
@@ -28,7 +34,7 @@ scheduler = AsyncIOScheduler(timezone=ZoneInfo("UTC"))
 
 # 🚀 Запуск
 async def main():
-    os.makedirs("files/connections", exist_ok=True)
+    connection_history.import_legacy_files()
     os.makedirs("users", exist_ok=True)
     await load_isp_cache()
     if not await check_environment():
@@ -37,6 +43,8 @@ async def main():
         await BOT.close()
         sys.exit(1)
 
+    db.replay_config_journal()
+
     dp.include_router(start_help.router)
     dp.include_router(payment.router)
     dp.include_router(user_actions.router)
@@ -78,9 +86,43 @@ async def main():
     )
 
     scheduler.add_job(db.ensure_peer_names, trigger="interval", minutes=1)
+    scheduler.add_job(
+        db.replay_config_journal,
+        trigger="interval",
+        seconds=db.JOURNAL_REPLAY_INTERVAL,
+    )
+    scheduler.add_job(
+        connection_history.prune,
+        trigger="cron",
+        hour=3,
+        minute=15,
+        timezone=ZoneInfo("Europe/Moscow"),
+        args=[CONNECTIONS_RETENTION_DAYS],
+    )
+
+    scheduler.add_job(
+        connection_history.flush,
+        trigger="interval",
+        seconds=CONNECTIONS_FLUSH_INTERVAL,
+        max_instances=1,
+        coalesce=True,
+    )
+    scheduler.add_job(
+        db.poll_activity,
+        trigger="interval",
+        seconds=db.ACTIVITY_POLL_INTERVAL,
+        max_instances=1,
+        coalesce=True,
+        next_run_time=datetime.now(ZoneInfo("UTC")),
+    )
 
     scheduler.start()
-    await dp.start_polling(BOT)
+    try:
+        await dp.start_polling(BOT)
+    finally:
+        ssh_pool.close_all()
+        connection_history.flush()
+        await close_isp_lookup()
 
 
 if __name__ == "__main__":
@@ -2,21 +2,81 @@ import os
 import subprocess
 import configparser
 import json
+import shlex
 import socket
 import logging
-import tempfile
+import threading
+import time
 from datetime import datetime, timezone
-from typing import Dict
+from typing import Callable, Dict, List, Optional, Tuple
 
-from service.parse_wg import parse_wg_show_output
+from service.parse_wg import parse_wg_dump_output
 from service.amnezia_server import get_remote_active_clients
-from service.base_model import ActiveClient
+from service.activity_cache import activity_cache
+from service.executor import run_blocking
+from service.base_model import ActiveClient, ProvisionedPeer, ServerSnapshot
+from service.peer_index import PeerIndex
+from service.wg_config import (
+    PeerBlock,
+    WgConfig,
+    files_fingerprint,
+    fingerprint_script,
+    parse_client_name,
+)
+from service.wg_keys import generate_preshared_key
+from service.ip_allocator import AddressAllocator
+from service.provisioner import CLIENT_NAME_RE, PeerProvisioner
+from service.wg_live import (
+    APPLY_FAILED_EXIT_CODE,
+    files_archive,
+    install_files_script,
+    interface_name,
+    remove_peer_script,
+    set_peer_script,
+    syncconf_script,
+)
+from service.config_journal import (
+    ConfigConflictError,
+    ConfigJournal,
+    ConfigTransaction,
+)
 
 EXPIRATIONS_FILE = "files/expirations.json"
 PAYMENTS_FILE = "files/payments.json"
 ADMINS_FILE = "files/admins.json"  # Новый файл для хранения админов
+CLIENTS_TABLE_PATH = "/opt/amnezia/awg/clientsTable"
+# Локальные копии закоммиченных файлов: их читают backup_rest.sh,
+# резервная копия для админов и раскатка на удалённые узлы
+SERVER_CONF_MIRROR = "files/server.conf"
+CLIENTS_TABLE_MIRROR = "files/clientsTable"
+ACTIVITY_POLL_INTERVAL = 30  # секунд между фоновыми опросами активности
+JOURNAL_REPLAY_INTERVAL = 300  # секунд между попытками доиграть журнал
+PEER_INDEX_TTL = 5  # секунд без повторной проверки отпечатка wg0.conf
+WG_SET_BATCH_LIMIT = 50  # больше изменённых пиров — применяем через syncconf
+DOCKER_EXEC_TIMEOUT = 20  # секунд на один docker exec
+DOCKER_RESTART_TIMEOUT = 60
+COMMIT_ATTEMPTS = 3
+# Ожидание результата в обработчиках; попытки и docker exec укладываются в него
+SNAPSHOT_TIMEOUT = DOCKER_EXEC_TIMEOUT * 2
+ACTIVE_LIST_TIMEOUT = 60
+COMMIT_TIMEOUT = DOCKER_EXEC_TIMEOUT * (COMMIT_ATTEMPTS * 2 + 1)
+CONFLICT_EXIT_CODE = 75  # wg0.conf изменился между чтением и записью
+COMMIT_LOCK_TIMEOUT = 10  # секунд ожидания flock в контейнере
+COMMITTED, UNCHANGED, FAILED = "committed", "unchanged", "failed"
+SNAPSHOT_BOUNDARY = "----8<----awg-snapshot----8<----"
 UTC = timezone.utc
 
+_peer_index: Optional[PeerIndex] = None
+_peer_index_checked_at = 0.0
+_peer_index_lock = threading.RLock()
+# Писатели этого процесса: чтение снимка, изменение и запись не пересекаются
+_commit_lock = threading.RLock()
+_address_allocator: Optional[AddressAllocator] = None
+_address_allocator_fingerprint = ""
+_names_reconciled_fingerprint = ""
+_commit_hooks: List[Callable[[str, List[dict], str], None]] = []
+config_journal = ConfigJournal()
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -101,94 +161,88 @@ def create_config(path="files/setting.ini"):
 
 
 def ensure_peer_names():
+    """Подписывает пиров без комментария '# name' и добавляет неизвестных
+    клиентов в clientsTable.
+
+    Задача запускается каждую минуту, поэтому сначала одним вызовом
+    sha256sum сверяется отпечаток файлов: если они не менялись с последней
+    проверки (или были записаны самим ботом), ничего не делается."""
+    global _names_reconciled_fingerprint
     setting = get_config()
-    wg_config_file = setting["wg_config_file"]
-    docker_container = setting["docker_container"]
+    fingerprint = get_server_files_fingerprint(
+        setting["docker_container"], setting["wg_config_file"]
+    )
+    if fingerprint and fingerprint == _names_reconciled_fingerprint:
+        return
+
+    def add_missing_names(
+        snapshot: ServerSnapshot, config: WgConfig, clients_table: List[dict]
+    ) -> Optional[str]:
+        global _names_reconciled_fingerprint
+        clients_dict = {
+            client["clientId"]: client["userData"] for client in clients_table
+        }
+        modified = False
+        for block in config.peers:
+            if block.has_name_comment:
+                continue
+            client_public_key = block.public_key
+            if client_public_key in clients_dict:
+                client_name = clients_dict[client_public_key].get(
+                    "clientName", f"client_{client_public_key[:6]}"
+                )
+            else:
+                client_name = f"client_{client_public_key[:6]}"
+                clients_dict[client_public_key] = {
+                    "clientName": client_name,
+                    "creationDate": datetime.now().isoformat(),
+                }
+                clients_table.append(
+                    {
+                        "clientId": client_public_key,
+                        "userData": clients_dict[client_public_key],
+                    }
+                )
+            block.set_name(client_name)
+            modified = True
 
-    clientsTable = get_full_clients_table()
-    clients_dict = {client["clientId"]: client["userData"] for client in clientsTable}
+        if not modified:
+            _names_reconciled_fingerprint = snapshot.fingerprint
+            return None
+        return ""
 
     try:
-        cmd = f"docker exec -i {docker_container} cat {wg_config_file}"
-        config_content = subprocess.check_output(cmd, shell=True).decode("utf-8")
-
-        lines = config_content.splitlines()
-        new_config_lines = []
-        i = 0
-        modified = False
-        updated_clientsTable = False
-
-        while i < len(lines):
-            line = lines[i]
-            if line.strip().startswith("[Peer]"):
-                peer_block = [line]
-                i += 1
-                has_name_comment = False
-                client_public_key = ""
-                while i < len(lines) and lines[i].strip() != "":
-                    peer_line = lines[i]
-                    if peer_line.strip().startswith("#"):
-                        has_name_comment = True
-                    elif peer_line.strip().startswith("PublicKey ="):
-                        client_public_key = peer_line.strip().split("=", 1)[1].strip()
-                    peer_block.append(peer_line)
-                    i += 1
-                if not has_name_comment:
-                    if client_public_key in clients_dict:
-                        client_name = clients_dict[client_public_key].get(
-                            "clientName", f"client_{client_public_key[:6]}"
-                        )
-                    else:
-                        client_name = f"client_{client_public_key[:6]}"
-                        clients_dict[client_public_key] = {
-                            "clientName": client_name,
-                            "creationDate": datetime.now().isoformat(),
-                        }
-                        updated_clientsTable = True
-                    peer_block.insert(1, f"# {client_name}")
-                    modified = True
-                new_config_lines.extend(peer_block)
-                if i < len(lines):
-                    new_config_lines.append(lines[i])
-                    i += 1
-            else:
-                new_config_lines.append(line)
-                i += 1
-
-        if modified:
-            new_config_content = "\n".join(new_config_lines)
-            with tempfile.NamedTemporaryFile(mode="w", delete=False) as temp_config:
-                temp_config.write(new_config_content)
-                temp_config_path = temp_config.name
-            docker_cmd = (
-                f"docker cp {temp_config_path} {docker_container}:{wg_config_file}"
-            )
-            subprocess.check_call(docker_cmd, shell=True)
-            os.remove(temp_config_path)
+        if transact_server_files(add_missing_names) == COMMITTED:
             logger.info(
                 "Конфигурационный файл WireGuard обновлён с добавлением комментариев # name_client."
             )
-
-        if updated_clientsTable:
-            clientsTable_list = [
-                {"clientId": key, "userData": value}
-                for key, value in clients_dict.items()
-            ]
-            with tempfile.NamedTemporaryFile(
-                mode="w", delete=False
-            ) as temp_clientsTable:
-                json.dump(clientsTable_list, temp_clientsTable)
-                temp_clientsTable_path = temp_clientsTable.name
-            docker_cmd = f"docker cp {temp_clientsTable_path} {docker_container}:/opt/amnezia/awg/clientsTable"
-            subprocess.check_call(docker_cmd, shell=True)
-            os.remove(temp_clientsTable_path)
-            logger.info("clientsTable обновлён с новыми клиентами.")
     except Exception as e:
         logger.error(
             f"Ошибка при обновлении комментариев в конфигурации WireGuard: {e}"
         )
 
 
+def _mark_names_reconciled(
+    config_content: str, clients_table: List[dict], fingerprint: str
+) -> None:
+    """Хук записи: если у всех пиров есть имя, ensure_peer_names может
+    не перепроверять эти файлы."""
+    global _names_reconciled_fingerprint
+    if all(block.has_name_comment for block in WgConfig.parse(config_content).peers):
+        _names_reconciled_fingerprint = fingerprint
+
+
+def on_config_committed(
+    hook: Callable[[str, List[dict], str], None],
+) -> None:
+    """Регистрирует обработчик, вызываемый после успешной записи wg0.conf и
+    clientsTable ботом: hook(config_content, clients_table, fingerprint)."""
+    _commit_hooks.append(hook)
+
+
+on_config_committed(_mark_names_reconciled)
+
+
 def get_config(path="files/setting.ini"):
     if not os.path.exists(path):
         create_config(path)
@@ -204,141 +258,552 @@ def get_config(path="files/setting.ini"):
     return out
 
 
-def root_add(id_user, ipv6=False):
+def root_add(id_user, ipv6=False) -> Optional[ProvisionedPeer]:
+    """Создаёт клиента в wg0.conf и clientsTable и возвращает его конфигурацию."""
     logger.info(f"➕ root_add - {id_user}")
+    peers = provision_many([id_user])
+    return peers[0] if peers else None
+
+
+def provision_many(names: List[str]) -> List[ProvisionedPeer]:
+    """Создаёт сразу несколько клиентов и возвращает их конфигурации.
+
+    Ключи и адреса генерируются в процессе бота, оба файла записываются и
+    изменения применяются одним вызовом docker exec. Уже существующие,
+    повторяющиеся и некорректные имена пропускаются."""
     setting = get_config()
     endpoint = setting["endpoint"]
     wg_config_file = setting["wg_config_file"]
-    docker_container = setting["docker_container"]
+    iface = interface_name(wg_config_file)
+
+    peers: List[ProvisionedPeer] = []
+    allocator: Optional[AddressAllocator] = None
+
+    def release_addresses() -> None:
+        if allocator is not None:
+            for peer in peers:
+                allocator.release(peer.address.split("/")[0])
+        peers.clear()
+
+    def add_peers(
+        snapshot: ServerSnapshot, config: WgConfig, clients_table: List[dict]
+    ) -> Optional[str]:
+        nonlocal allocator
+        release_addresses()  # адреса предыдущей попытки после конфликта
+        index = get_peer_index(snapshot=snapshot)
+        allocator = get_address_allocator(
+            index, config.interface_value("Address") or ""
+        )
+        try:
+            provisioner = PeerProvisioner(config, clients_table, endpoint, allocator)
+        except ValueError as e:
+            logger.error(f"Не удалось подготовить создание клиентов: {e}")
+            return None
+
+        for name in dict.fromkeys(names):
+            if index.get_by_name(name):
+                logger.info(
+                    f"Пользователь {name} уже существует. Генерация конфигурации невозможна без приватного ключа."
+                )
+                continue
+            if not CLIENT_NAME_RE.match(name):
+                logger.error(f"Некорректное имя клиента: {name!r}")
+                continue
+            try:
+                peers.append(provisioner.provision(name))
+            except ValueError as e:
+                logger.error(f"Не удалось создать клиента {name}: {e}")
+                break  # закончились свободные адреса
+        if not peers:
+            return None
+
+        if len(peers) == 1:
+            return set_peer_script(
+                iface,
+                peers[0].public_key,
+                allowed_ips=peers[0].address,
+                config_file=wg_config_file,
+            )
+        return syncconf_script(wg_config_file)
+
+    result = FAILED
+    try:
+        result = transact_server_files(add_peers)
+    finally:
+        if result != COMMITTED:
+            # В том числе при исключении — иначе адреса останутся в резерве
+            release_addresses()
+    if result != COMMITTED:
+        return []
 
-    clients = get_client_list()
-    client_entry = next((c for c in clients if c[0] == id_user), None)
-    if client_entry:
-        logger.info(
-            f"Пользователь {id_user} уже существует. Генерация конфигурации невозможна без приватного ключа."
+    for peer in peers:
+        if allocator is not None:
+            allocator.commit(peer.address.split("/")[0])
+        logger.info(f"Клиент {peer.name} добавлен в WireGuard ({peer.address}).")
+    return list(peers)
+
+
+def rotate_preshared_keys(entries: List[dict]) -> Optional[int]:
+    """Обновляет PresharedKey клиентов за один проход по wg0.conf.
+
+    entries — список {"client_name": ..., "new_preshared_key": ...}; значение
+    False/"false" означает «сгенерировать новый ключ», None или "" — оставить
+    ключ без изменений. Клиент ищется по имени
+    из clientsTable или комментарию в секции [Peer]. Записываются и
+    применяются только пиры, у которых ключ действительно изменился.
+    Возвращает число изменённых пиров или None при ошибке."""
+    setting = get_config()
+    wg_config_file = setting["wg_config_file"]
+    changed: List[PeerBlock] = []
+
+    def update_keys(
+        snapshot: ServerSnapshot, config: WgConfig, clients_table: List[dict]
+    ) -> Optional[str]:
+        changed.clear()
+        client_map = snapshot.client_map()
+        blocks_by_name: Dict[str, PeerBlock] = {}
+        for peer_block in config.peers:
+            name = client_map.get(peer_block.public_key, peer_block.name)
+            if name:
+                blocks_by_name.setdefault(name, peer_block)
+
+        for entry in entries:
+            client_name = str(entry["client_name"])
+            found = blocks_by_name.get(client_name)
+            if found is None:
+                logger.warning(f"Клиент {client_name} не найден в wg0.conf")
+                continue
+            new_key = entry.get("new_preshared_key")
+            if new_key is False or new_key == "false":
+                new_key = generate_preshared_key()
+            elif not new_key:
+                # Ключ неизвестен (например, в базе его нет) — пир не трогаем
+                continue
+            if found.set("PresharedKey", new_key):
+                changed.append(found)
+
+        if not changed:
+            return None
+        if len(changed) <= WG_SET_BATCH_LIMIT:
+            iface = interface_name(wg_config_file)
+            return " && ".join(
+                set_peer_script(iface, block.public_key, config_file=wg_config_file)
+                for block in changed
+            )
+        return syncconf_script(wg_config_file)
+
+    result = transact_server_files(update_keys)
+    if result == FAILED:
+        return None
+    if result == UNCHANGED:
+        logger.info("PresharedKey клиентов не изменились.")
+        return 0
+
+    logger.info(f"PresharedKey обновлены у {len(changed)} клиентов.")
+    return len(changed)
+
+
+def get_address_allocator(index: PeerIndex, server_address: str = "") -> AddressAllocator:
+    """Аллокатор адресов клиентов, синхронизированный с индексом пиров.
+    server_address — Address из [Interface] wg0.conf."""
+    global _address_allocator, _address_allocator_fingerprint
+    with _peer_index_lock:
+        if _address_allocator is None:
+            _address_allocator = AddressAllocator.from_setting(
+                get_config().get("client_subnets")
+            )
+        if index.fingerprint != _address_allocator_fingerprint:
+            _address_allocator.rebuild(index.by_ip.keys(), server_address)
+            _address_allocator_fingerprint = index.fingerprint
+        return _address_allocator
+
+
+def transact_server_files(
+    mutate: Callable[[ServerSnapshot, WgConfig, List[dict]], Optional[str]],
+    attempts: int = COMMIT_ATTEMPTS,
+) -> str:
+    """Читает снимок, изменяет wg0.conf/clientsTable в памяти и записывает их.
+
+    mutate(snapshot, config, clients_table) меняет config и clients_table на
+    месте и возвращает команды применения ("" — без применения) или None,
+    если записывать нечего. Если файлы на сервере изменились между чтением
+    и записью, mutate вызывается повторно на свежем снимке.
+    Возвращает COMMITTED, UNCHANGED или FAILED."""
+    for attempt in range(1, attempts + 1):
+        try:
+            with _commit_lock:
+                snapshot = get_server_snapshot()
+                if not snapshot.fingerprint:
+                    return FAILED
+                config = WgConfig.parse(snapshot.config)
+                clients_table = [dict(client) for client in snapshot.clients_table]
+                apply_script = mutate(snapshot, config, clients_table)
+                if apply_script is None:
+                    return UNCHANGED
+                if commit_server_files(
+                    config.render(),
+                    clients_table,
+                    apply_script,
+                    base_fingerprint=snapshot.fingerprint,
+                ):
+                    return COMMITTED
+                return FAILED
+        except ConfigConflictError:
+            logger.warning(
+                f"Конфигурация WireGuard изменилась во время записи, попытка {attempt}/{attempts}."
+            )
+    logger.error("Не удалось записать конфигурацию WireGuard: постоянные конфликты.")
+    return FAILED
+
+
+def commit_server_files(
+    config_content: str,
+    clients_table: List[dict],
+    apply_script: str = "",
+    base_fingerprint: Optional[str] = None,
+) -> bool:
+    """Атомарно записывает wg0.conf и clientsTable и применяет изменения.
+
+    Транзакция сначала сохраняется в локальный журнал, затем оба файла
+    передаются tar-архивом через stdin одного docker exec, распаковываются
+    во временный каталог рядом с wg0.conf и переносятся на место через mv.
+    Если задан base_fingerprint, перед переносом проверяется, что файлы на
+    сервере не изменились, иначе выбрасывается ConfigConflictError.
+    Проверка, распаковка и перенос выполняются под flock в контейнере,
+    а записи из этого процесса дополнительно сериализует _commit_lock;
+    отпечаток ловит изменения, сделанные в обход бота."""
+    with _commit_lock:
+        return _commit_server_files(
+            config_content, clients_table, apply_script, base_fingerprint
         )
+
+
+def _commit_server_files(
+    config_content: str,
+    clients_table: List[dict],
+    apply_script: str,
+    base_fingerprint: Optional[str],
+) -> bool:
+    clients_table_raw = json.dumps(clients_table)
+    tx = config_journal.begin(
+        base_fingerprint=base_fingerprint or "",
+        fingerprint=files_fingerprint(config_content, clients_table_raw),
+        config=config_content,
+        clients_table_raw=clients_table_raw,
+        apply_script=apply_script,
+    )
+    try:
+        _execute_transaction(tx, check_base=base_fingerprint is not None)
+    except ConfigConflictError:
+        config_journal.finish(tx)
+        invalidate_peer_index()
+        raise
+    except subprocess.SubprocessError as e:
+        # Запись журнала остаётся и будет доиграна при следующем старте
+        logger.error(f"Ошибка при записи конфигурации WireGuard: {exec_error(e)}")
+        invalidate_peer_index()
         return False
-    else:
-        cmd = ["./newclient.sh", id_user, endpoint, wg_config_file, docker_container]
-        if subprocess.call(cmd) == 0:
-            return True
-        return False
+    config_journal.finish(tx)
+    write_config_mirror(tx.config, tx.clients_table_raw)
+
+    # Содержимое файлов известно — обновляем индекс без повторного чтения
+    get_peer_index(
+        snapshot=ServerSnapshot(
+            config=config_content,
+            clients_table=clients_table,
+            wg_dump="",
+            fingerprint=tx.fingerprint,
+            taken_at=datetime.now(UTC),
+        )
+    )
+    for hook in _commit_hooks:
+        hook(config_content, clients_table, tx.fingerprint)
+    return True
 
 
-def get_clients_from_clients_table():
+def _execute_transaction(tx: ConfigTransaction, check_base: bool) -> None:
     setting = get_config()
+    wg_config_file = setting["wg_config_file"]
     docker_container = setting["docker_container"]
-    clients_table_path = "/opt/amnezia/awg/clientsTable"
+
+    archive = files_archive(
+        {"wg0.conf": tx.config, "clientsTable": tx.clients_table_raw}
+    )
+
+    conf = shlex.quote(wg_config_file)
+    lock_file = shlex.quote(f"{os.path.dirname(wg_config_file)}/.bot.lock")
+    script = (
+        "set -e; "
+        f"exec 9>{lock_file}; "
+        f"if command -v flock > /dev/null; then flock -w {COMMIT_LOCK_TIMEOUT} 9; fi; "
+    )
+    if check_base:
+        script += (
+            f"current=$({fingerprint_script([wg_config_file, CLIENTS_TABLE_PATH])}); "
+            f'[ "$current" = "{tx.base_fingerprint}" ] || '
+            f"{{ cat > /dev/null; exit {CONFLICT_EXIT_CODE}; }}; "
+        )
+    apply_script = ""
+    if tx.apply_script:
+        apply_script = f"( {tx.apply_script} ) || exit {APPLY_FAILED_EXIT_CODE}"
+    script += install_files_script(
+        {"wg0.conf": wg_config_file, "clientsTable": CLIENTS_TABLE_PATH},
+        apply_script,
+    )
     try:
-        cmd = f"docker exec -i {docker_container} cat {clients_table_path}"
-        call = subprocess.check_output(cmd, shell=True)
-        clients_table = json.loads(call.decode("utf-8"))
-        client_map = {
-            client["clientId"]: client["userData"]["clientName"]
-            for client in clients_table
-        }
-        return client_map
+        subprocess.run(
+            ["docker", "exec", "-i", docker_container, "sh", "-c", script],
+            input=archive,
+            check=True,
+            timeout=DOCKER_EXEC_TIMEOUT,
+        )
     except subprocess.CalledProcessError as e:
-        logger.error(f"Ошибка при получении clientsTable: {e}")
-        return {}
-    except json.JSONDecodeError:
-        logger.error("Ошибка при разборе clientsTable JSON.")
-        return {}
+        if e.returncode == CONFLICT_EXIT_CODE:
+            raise ConfigConflictError(tx.txid) from e
+        if e.returncode != APPLY_FAILED_EXIT_CODE:
+            raise
+        # Файлы уже на месте, коммит состоялся; не принял изменения только
+        # интерфейс — применяем весь конфиг, в крайнем случае перезапуском
+        logger.warning(
+            f"Живое применение транзакции {tx.txid} не удалось, выполняю wg syncconf."
+        )
+        if not sync_wg_interface():
+            restart_container()
+
 
+def exec_error(e: subprocess.SubprocessError) -> str:
+    """Описание ошибки docker exec без текста команды: в скриптах бывают
+    ключи и содержимое конфигурации."""
+    if isinstance(e, subprocess.CalledProcessError):
+        return f"код выхода {e.returncode}"
+    if isinstance(e, subprocess.TimeoutExpired):
+        return f"таймаут {e.timeout} с"
+    return type(e).__name__
 
-def get_full_clients_table():
+
+def restart_container() -> bool:
+    """Перезапускает контейнер: крайняя мера, если wg не принимает конфиг."""
+    docker_container = get_config()["docker_container"]
+    logger.warning(f"Перезапускаю контейнер {docker_container}.")
+    try:
+        subprocess.run(
+            ["docker", "restart", docker_container],
+            check=True,
+            timeout=DOCKER_RESTART_TIMEOUT,
+        )
+        return True
+    except subprocess.SubprocessError as e:
+        logger.error(f"Не удалось перезапустить {docker_container}: {exec_error(e)}")
+        return False
+
+
+def write_config_mirror(config_content: str, clients_table_raw: str) -> None:
+    """Обновляет локальные копии wg0.conf и clientsTable теми же байтами,
+    что записаны в контейнер, чтобы отпечатки на узлах совпадали."""
+    for path, content in (
+        (SERVER_CONF_MIRROR, config_content),
+        (CLIENTS_TABLE_MIRROR, clients_table_raw),
+    ):
+        tmp_path = f"{path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Не удалось обновить локальную копию {path}: {e}")
+
+
+def replay_config_journal() -> None:
+    """Доигрывает коммиты конфигурации, прерванные остановкой бота или
+    недоступностью контейнера. Запускается при старте и периодически."""
     setting = get_config()
-    docker_container = setting["docker_container"]
-    clients_table_path = "/opt/amnezia/awg/clientsTable"
+    with _commit_lock:
+        pending = config_journal.pending()
+        for tx in pending:
+            current = get_server_files_fingerprint(
+                setting["docker_container"], setting["wg_config_file"]
+            )
+            if not current:
+                # Состояние файлов неизвестно — запись остаётся до следующей попытки
+                logger.warning(
+                    f"Транзакция {tx.txid} отложена: не удалось прочитать отпечаток файлов."
+                )
+                continue
+            if current == tx.fingerprint:
+                # Файлы записаны, но применение могло не выполниться
+                logger.info(f"Транзакция {tx.txid} уже записана, применяю конфигурацию.")
+                sync_wg_interface()
+                write_config_mirror(tx.config, tx.clients_table_raw)
+            elif current == tx.base_fingerprint or not tx.base_fingerprint:
+                logger.info(f"Доигрываю транзакцию конфигурации {tx.txid}.")
+                try:
+                    _execute_transaction(tx, check_base=False)
+                except subprocess.SubprocessError as e:
+                    logger.error(
+                        f"Не удалось доиграть транзакцию {tx.txid}: {exec_error(e)}"
+                    )
+                    continue
+                write_config_mirror(tx.config, tx.clients_table_raw)
+            else:
+                logger.warning(
+                    f"Транзакция {tx.txid} пропущена: файлы на сервере уже изменены."
+                )
+            config_journal.finish(tx)
+        if pending:
+            invalidate_peer_index()
+
+
+def get_server_files_fingerprint(docker_container: str, wg_config_file: str) -> str:
+    """Отпечаток wg0.conf и clientsTable одним вызовом docker exec; "" — если
+    контейнер недоступен."""
+    script = fingerprint_script([wg_config_file, CLIENTS_TABLE_PATH])
     try:
-        cmd = f"docker exec -i {docker_container} cat {clients_table_path}"
-        call = subprocess.check_output(cmd, shell=True)
-        clients_table = json.loads(call.decode("utf-8"))
-        return clients_table
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Ошибка при получении clientsTable: {e}")
-        return []
-    except json.JSONDecodeError:
-        logger.error("Ошибка при разборе clientsTable JSON.")
-        return []
+        output = subprocess.check_output(
+            ["docker", "exec", "-i", docker_container, "sh", "-c", script],
+            timeout=DOCKER_EXEC_TIMEOUT,
+        ).decode("utf-8")
+    except subprocess.SubprocessError as e:
+        logger.error(f"Ошибка при получении отпечатка конфигурации: {e}")
+        return ""
+    return output.strip()
 
 
-def parse_client_name(full_name):
-    return full_name.split("[")[0].strip()
+def invalidate_peer_index():
+    """Сбрасывает индекс после собственных изменений wg0.conf/clientsTable."""
+    global _peer_index
+    with _peer_index_lock:
+        _peer_index = None
 
 
-def get_client_list():
+def get_server_snapshot() -> ServerSnapshot:
+    """Получает wg0.conf, clientsTable и wg show all dump одним вызовом docker exec.
+
+    Части ответа разделены строкой SNAPSHOT_BOUNDARY. Снимок предназначен для
+    повторного использования в рамках обработки одного апдейта."""
     setting = get_config()
     wg_config_file = setting["wg_config_file"]
     docker_container = setting["docker_container"]
 
-    client_map = get_clients_from_clients_table()
+    separator = f"printf '\\n%s\\n' '{SNAPSHOT_BOUNDARY}'"
+    script = (
+        f"cat {shlex.quote(wg_config_file)}; {separator}; "
+        f"cat {CLIENTS_TABLE_PATH} 2>/dev/null; {separator}; "
+        "wg show all dump 2>/dev/null || true"
+    )
+    taken_at = datetime.now(UTC)
+    try:
+        output = subprocess.check_output(
+            ["docker", "exec", "-i", docker_container, "sh", "-c", script],
+            timeout=DOCKER_EXEC_TIMEOUT,
+        ).decode("utf-8")
+        config, clients_table_raw, wg_dump = output.split(
+            f"\n{SNAPSHOT_BOUNDARY}\n", 2
+        )
+        if not config.strip():
+            raise ValueError(f"пустой {wg_config_file}")
+    except (subprocess.SubprocessError, ValueError) as e:
+        logger.error(f"Ошибка при получении снимка состояния сервера: {e}")
+        return ServerSnapshot(
+            config="", clients_table=[], wg_dump="", fingerprint="", taken_at=taken_at
+        )
 
     try:
-        cmd = f"docker exec -i {docker_container} cat {wg_config_file}"
-        call = subprocess.check_output(cmd, shell=True)
-        config_content = call.decode("utf-8")
-
-        clients = []
-        lines = config_content.splitlines()
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            if line.startswith("[Peer]"):
-                client_public_key = ""
-                allowed_ips = ""
-                client_name = "Unknown"
-                i += 1
-                while i < len(lines):
-                    peer_line = lines[i].strip()
-                    if peer_line == "":
-                        break
-                    if peer_line.startswith("#"):
-                        full_client_name = peer_line[1:].strip()
-                        client_name = parse_client_name(full_client_name)
-                    elif peer_line.startswith("PublicKey ="):
-                        client_public_key = peer_line.split("=", 1)[1].strip()
-                    elif peer_line.startswith("AllowedIPs ="):
-                        allowed_ips = peer_line.split("=", 1)[1].strip()
-                    i += 1
-                client_name = client_map.get(
-                    client_public_key,
-                    client_name if "client_name" in locals() else "Unknown",
+        clients_table = json.loads(clients_table_raw) if clients_table_raw else []
+    except json.JSONDecodeError:
+        logger.error("Ошибка при разборе clientsTable JSON.")
+        clients_table = []
+
+    fingerprint = files_fingerprint(config, clients_table_raw)
+    snapshot = ServerSnapshot(
+        config=config,
+        clients_table=clients_table,
+        wg_dump=wg_dump,
+        fingerprint=fingerprint,
+        taken_at=taken_at,
+    )
+    return snapshot
+
+
+def get_peer_index(
+    force: bool = False, snapshot: Optional[ServerSnapshot] = None
+) -> PeerIndex:
+    """Возвращает индекс пиров из памяти, перечитывая wg0.conf только если
+    изменился отпечаток файлов на сервере. Если передан snapshot, индекс
+    обновляется из него без обращения к контейнеру."""
+    global _peer_index, _peer_index_checked_at
+
+    with _peer_index_lock:
+        if snapshot is not None:
+            if not snapshot.fingerprint:
+                return _peer_index if _peer_index is not None else PeerIndex([])
+            if force or _peer_index is None or (
+                _peer_index.fingerprint != snapshot.fingerprint
+            ):
+                _peer_index = PeerIndex.from_config(
+                    snapshot.config, snapshot.client_map(), snapshot.fingerprint
                 )
-                clients.append([client_name, client_public_key, allowed_ips])
-            else:
-                i += 1
-        return clients
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Ошибка при получении списка клиентов: {e}")
-        return []
+                logger.info(f"Индекс пиров перестроен: {len(_peer_index)} клиентов.")
+            _peer_index_checked_at = time.monotonic()
+            return _peer_index
 
+        if (
+            not force
+            and _peer_index is not None
+            and time.monotonic() - _peer_index_checked_at < PEER_INDEX_TTL
+        ):
+            return _peer_index
 
-def get_wg_show_output(docker_container: str) -> str:
-    """Получает вывод команды 'wg show' из указанного Docker-контейнера."""
-    cmd = f"docker exec -i {docker_container} wg show"
-    try:
-        call = subprocess.check_output(cmd, shell=True)
-        return call.decode("utf-8")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Ошибка при выполнении wg show: {e}")
-        return ""
+        if not force and _peer_index is not None:
+            setting = get_config()
+            fingerprint = get_server_files_fingerprint(
+                setting["docker_container"], setting["wg_config_file"]
+            )
+            if fingerprint and fingerprint == _peer_index.fingerprint:
+                _peer_index_checked_at = time.monotonic()
+                return _peer_index
 
+        return get_peer_index(force=force, snapshot=get_server_snapshot())
 
 
-def get_active_list() -> Dict[str, ActiveClient]:
+def get_client_list(snapshot: Optional[ServerSnapshot] = None):
+    return get_peer_index(snapshot=snapshot).as_client_list()
+
+
+def hot_apply(script: str) -> bool:
+    """Выполняет команды wg set/syncconf в контейнере без перезапуска интерфейса."""
     setting = get_config()
     docker_container = setting["docker_container"]
+    try:
+        subprocess.check_call(
+            ["docker", "exec", "-i", docker_container, "sh", "-c", script],
+            timeout=DOCKER_EXEC_TIMEOUT,
+        )
+        return True
+    except subprocess.SubprocessError as e:
+        logger.error(f"Ошибка при применении изменений WireGuard: {exec_error(e)}")
+        return False
+
+
+def sync_wg_interface() -> bool:
+    """Применяет текущий wg0.conf к интерфейсу через wg syncconf."""
+    setting = get_config()
+    return hot_apply(syncconf_script(setting["wg_config_file"]))
+
 
+def get_active_list(
+    snapshot: Optional[ServerSnapshot] = None,
+) -> Dict[str, ActiveClient]:
     try:
-        clients = get_client_list()
-        client_key_map = {client[1]: client[0] for client in clients}
+        if snapshot is None:
+            snapshot = get_server_snapshot()
+        client_key_map = get_peer_index(snapshot=snapshot).client_key_map()
 
         # Локальные клиенты
-        wg_output = get_wg_show_output(docker_container)
+        wg_output = snapshot.wg_dump
         local_active: Dict[str, ActiveClient] = {}
         if wg_output:
-            local_active = parse_wg_show_output(wg_output, client_key_map)
+            local_active = parse_wg_dump_output(wg_output, client_key_map)
             for client in local_active.values():
                 client.server = "local"
 
@@ -354,31 +819,101 @@ def get_active_list() -> Dict[str, ActiveClient]:
         return {}
 
 
+def poll_activity() -> None:
+    """Фоновый опрос: обновляет кеш активности клиентов всех нод.
+
+    Снимок заодно поддерживает индекс пиров в актуальном состоянии."""
+    snapshot = get_server_snapshot()
+    if not snapshot.fingerprint:
+        logger.warning("Опрос активности пропущен: нет снимка сервера.")
+        return
+    activity_cache.update(get_active_list(snapshot))
+
+
 def deactive_user_db(client_name):
-    setting = get_config()
-    wg_config_file = setting["wg_config_file"]
-    docker_container = setting["docker_container"]
+    """Удаляет клиента из wg0.conf и clientsTable и с работающего интерфейса."""
+    iface = interface_name(get_config()["wg_config_file"])
+    found = False
+
+    def remove_peer(
+        snapshot: ServerSnapshot, config: WgConfig, clients_table: List[dict]
+    ) -> Optional[str]:
+        nonlocal found
+        peer = get_peer_index(snapshot=snapshot).get_by_name(client_name)
+        found = peer is not None
+        if peer is None:
+            return None
+        config.remove_peer(peer.public_key)
+        clients_table[:] = [
+            client
+            for client in clients_table
+            if client.get("clientId") != peer.public_key
+        ]
+        return remove_peer_script(iface, peer.public_key)
 
-    clients = get_client_list()
-    client_entry = next((c for c in clients if c[0] == client_name), None)
-    if client_entry:
-        client_public_key = client_entry[1]
-        if (
-            subprocess.call(
-                [
-                    "./removeclient.sh",
-                    client_name,
-                    client_public_key,
-                    wg_config_file,
-                    docker_container,
-                ]
-            )
-            == 0
-        ):
-            return True
-    else:
+    result = transact_server_files(remove_peer)
+    if not found:
         logger.error(f"Пользователь {client_name} не найден в списке клиентов.")
-    return False
+        return False
+    return result == COMMITTED
+
+
+# Асинхронные варианты для обработчиков: блокирующие docker exec и SSH
+# выполняются в пуле потоков service.executor и не останавливают polling.
+
+
+async def get_server_snapshot_async() -> ServerSnapshot:
+    return await run_blocking(get_server_snapshot, timeout=SNAPSHOT_TIMEOUT)
+
+
+async def get_peer_index_async(
+    force: bool = False, snapshot: Optional[ServerSnapshot] = None
+) -> PeerIndex:
+    if snapshot is not None:
+        return get_peer_index(force=force, snapshot=snapshot)
+    return await run_blocking(get_peer_index, force, timeout=SNAPSHOT_TIMEOUT)
+
+
+async def get_client_list_async(snapshot: Optional[ServerSnapshot] = None):
+    return (await get_peer_index_async(snapshot=snapshot)).as_client_list()
+
+
+async def get_active_list_async(
+    snapshot: Optional[ServerSnapshot] = None,
+) -> Dict[str, ActiveClient]:
+    return await run_blocking(
+        get_active_list, snapshot, timeout=ACTIVE_LIST_TIMEOUT, kind="ssh"
+    )
+
+
+async def get_cached_active_list() -> Tuple[Dict[str, ActiveClient], float]:
+    """Активность клиентов из кеша фонового опроса и возраст данных в
+    секундах. До первого опроса данные запрашиваются напрямую."""
+    if not activity_cache.ready:
+        activity_cache.update(await get_active_list_async())
+    return activity_cache.get_all(), activity_cache.age() or 0.0
+
+
+async def get_cached_activity(username: str) -> Tuple[Optional[ActiveClient], float]:
+    if not activity_cache.ready:
+        activity_cache.update(await get_active_list_async())
+    return activity_cache.get(username), activity_cache.age() or 0.0
+
+
+async def root_add_async(id_user, ipv6=False) -> Optional[ProvisionedPeer]:
+    return await run_blocking(root_add, id_user, ipv6, timeout=COMMIT_TIMEOUT)
+
+
+async def provision_many_async(names: List[str]) -> List[ProvisionedPeer]:
+    return await run_blocking(provision_many, names, timeout=COMMIT_TIMEOUT)
+
+
+async def rotate_preshared_keys_async(entries: List[dict]) -> Optional[int]:
+    return await run_blocking(rotate_preshared_keys, entries, timeout=COMMIT_TIMEOUT)
+
+
+async def deactive_user_db_async(client_name) -> bool:
+    return await run_blocking(deactive_user_db, client_name, timeout=COMMIT_TIMEOUT)
 
 
 def load_expirations():
@@ -1,18 +1,21 @@
 import asyncio
 import datetime
 from io import BytesIO
-import json
 import logging
-import os
 import re
-import aiofiles
-import aiohttp
+import time
 import humanize
 from typing import cast, Optional
-from zoneinfo import ZoneInfo
 import db
 from service.system_stats import get_vnstati_image_to_buffer
-from service.amnezia_server import check_wg_show_remote, deploy_to_all_servers
+from service.amnezia_server import (
+    DEPLOY_DEADLINE,
+    check_wg_show_remote,
+    deploy_to_all_servers,
+    get_nodes_status,
+)
+from service.connection_history import connection_history
+from service.executor import run_blocking
 from aiogram import Bot
 from aiogram import Router, F
 from aiogram.types import (
@@ -22,24 +25,20 @@ from aiogram.types import (
     InlineKeyboardButton,
     BufferedInputFile,
 )
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.enums import ParseMode
 from aiogram.utils.chat_action import ChatActionSender
 from aiogram.fsm.context import FSMContext
 from admin_service.admin import is_privileged
-from service.send_backup_admin import create_db_backup
-from utils import (
-    generate_config_text,
-    get_isp_info,
-    parse_relative_time,
-    parse_transfer,
-)
+from service.send_backup_admin import BACKUP_TIMEOUT, create_db_backup
+from utils import format_age, generate_config_text, get_isp_info_many, ip_api
 from fsm.callback_data import ClientCallbackFactory, UserConfCallbackFactory
 from keyboard.admin_menu import get_client_profile_keyboard
 from keyboard.menu import get_home_keyboard
 from fsm.admin_state import AdminState
-from service.vpn_service import create_vpn_config
-from service.db_instance import user_db
+from service.vpn_service import build_configs_archive, create_vpn_config
+from service.db_instance import async_user_db
+from service.base_model import WgPeer
 from settings import ADMINS, DB_FILE, MODERATORS
 
 logger = logging.getLogger(__name__)
@@ -129,7 +128,7 @@ async def admin_list_users_callback(callback: CallbackQuery):
 
     try:
         logger.info("Fetching client list...")
-        clients = db.get_client_list()
+        clients = await db.get_client_list_async()
         logger.info(f"Found {len(clients)} clients.")
 
         if not clients:
@@ -142,8 +141,8 @@ async def admin_list_users_callback(callback: CallbackQuery):
             await callback.answer()
             return
 
-        activ_clients = db.get_active_list()
-        logger.info(f"Fetched active clients data.")
+        activ_clients, data_age = await db.get_cached_active_list()
+        logger.info(f"Fetched active clients data ({data_age:.0f} s old).")
 
         keyboard_buttons: list = []
 
@@ -161,15 +160,11 @@ async def admin_list_users_callback(callback: CallbackQuery):
             status = "❌"  # По умолчанию неактивен
             server = ""  # Инициализируем переменную server значением по умолчанию
 
-            if (
-                activ_client
-                and activ_client.last_time
-                and activ_client.last_time.lower() not in ["never", "нет данных", "-"]
-            ):
-                status = "🟢"  # Упрощенно ставим 🟢 если строка рукопожатия не пуста и не Never/Нет данных/
+            if activ_client and activ_client.latest_handshake:
+                status = "🟢"  # Упрощенно ставим 🟢 если было хотя бы одно рукопожатие
                 server = activ_client.server if activ_client.server else ""
 
-            telegram_name = user_db.get_user_by_telegram_id(username)
+            telegram_name = await async_user_db.get_user_by_telegram_id(username)
 
             if telegram_name is not False:
                 button_text = f"{status} {telegram_name.name} {server[:5]}"
@@ -203,7 +198,10 @@ async def admin_list_users_callback(callback: CallbackQuery):
 
         if isinstance(callback.message, Message):
             await callback.message.edit_text(
-                text="Выберите пользователя:",
+                text=(
+                    "Выберите пользователя:\n"
+                    f"🕒 Активность на {format_age(data_age)} назад"
+                ),
                 reply_markup=keyboard,
             )
         logger.info(f"Displayed client list to user {user_id}")
@@ -246,68 +244,46 @@ async def validate_callback_data(callback: CallbackQuery) -> bool:
     return True
 
 
-async def get_client_info(username: str) -> Optional[tuple]:
+async def get_client_info(username: str) -> Optional[WgPeer]:
     """Получает базовую информацию о клиенте."""
-    clients = db.get_client_list()
-    return next((c for c in clients if c[0] == username), None)
+    index = await db.get_peer_index_async()
+    return index.get_by_name(username)
 
 
-def get_client_network_info(client_info: tuple) -> tuple[str, str, str, str]:
+def get_client_network_info(client_info: WgPeer) -> tuple[str, str, str, str]:
     """Извлекает сетевую информацию клиента."""
     status = "🔴 Офлайн"
     incoming_traffic = "↓—"
     outgoing_traffic = "↑—"
     ipv4_address = "—"
 
-    if (
-        isinstance(client_info, (tuple, list))
-        and len(client_info) > 2
-        and client_info[2]
-    ):
-        ip_match = re.search(r"(\d{1,3}\.){3}\d{1,3}/\d+", str(client_info[2]))
+    if client_info.allowed_ips:
+        ip_match = re.search(r"(\d{1,3}\.){3}\d{1,3}/\d+", client_info.allowed_ips)
         ipv4_address = ip_match.group(0) if ip_match else "—"
 
     return status, incoming_traffic, outgoing_traffic, ipv4_address
 
 
 async def update_client_activity_status(
-    username: str, status: str, incoming_traffic: str, outgoing_traffic: str
+    username: str,
+    status: str,
+    incoming_traffic: str,
+    outgoing_traffic: str,
 ) -> tuple[str, str, str]:
-    """Обновляет статус активности клиента."""
-    active_clients = db.get_active_list()
-    active_info = active_clients.get(username)
-
-    if active_info and active_info.last_time.lower() not in [
-        "never",
-        "нет данных",
-        "-",
-    ]:
-        try:
-            last_handshake = parse_relative_time(active_info.last_time)
-            if (
-                last_handshake
-                and (
-                    datetime.datetime.now(ZoneInfo("Europe/Moscow")) - last_handshake
-                ).total_seconds()
-                <= 60
-            ):
-                status = "🟢 Онлайн"
-            else:
-                status = "❌ Офлайн"
+    """Обновляет статус активности клиента по кешу фонового опроса."""
+    active_info, data_age = await db.get_cached_activity(username)
 
-            transfer_result = parse_transfer(active_info.transfer)
-            if transfer_result:
-                incoming_bytes, outgoing_bytes = transfer_result
-                incoming_traffic = f"↓{humanize.naturalsize(incoming_bytes)}"
-                outgoing_traffic = f"↑{humanize.naturalsize(outgoing_bytes)}"
-
-        except Exception as e:
-            logger.error(f"Ошибка при анализе активности клиента: {e}", exc_info=True)
+    if active_info and active_info.latest_handshake:
+        handshake_age = time.time() - active_info.latest_handshake
+        status = "🟢 Онлайн" if handshake_age <= 60 else "❌ Офлайн"
+        incoming_traffic = f"↓{humanize.naturalsize(active_info.rx_bytes)}"
+        outgoing_traffic = f"↑{humanize.naturalsize(active_info.tx_bytes)}"
 
+    status += f" (данные {format_age(data_age)} назад)"
     return status, incoming_traffic, outgoing_traffic
 
 
-def format_profile_text(
+async def format_profile_text(
     username: str,
     ipv4_address: str,
     status: str,
@@ -315,7 +291,7 @@ def format_profile_text(
     incoming_traffic: str,
 ) -> str:
     """Форматирует текст профиля пользователя."""
-    telegram_name = user_db.get_user_by_telegram_id(username)
+    telegram_name = await async_user_db.get_user_by_telegram_id(username)
     telegram_name_text = telegram_name.name if telegram_name is not False else ""
     is_unlimited = telegram_name.is_unlimited if telegram_name is not False else 0
     telegram_end_date_text = (
@@ -361,7 +337,7 @@ async def client_selected_callback(
             )
         )
 
-        text = format_profile_text(
+        text = await format_profile_text(
             username, ipv4_address, status, outgoing_traffic, incoming_traffic
         )
 
@@ -407,7 +383,9 @@ async def create_backup_callback(callback: CallbackQuery):
     try:
         bot = cast(Bot, callback.bot)
         async with ChatActionSender.upload_document(bot=bot, chat_id=user_id):
-            backup_bytes = create_db_backup(DB_FILE)
+            backup_bytes = await run_blocking(
+                create_db_backup, DB_FILE, timeout=BACKUP_TIMEOUT, kind="files"
+            )
             await bot.send_document(
                 chat_id=user_id,
                 document=BufferedInputFile(file=backup_bytes, filename="backup.zip"),
@@ -431,27 +409,20 @@ async def client_connections_callback(callback: CallbackQuery):
         return
 
     username = callback.data.split("connections_")[1]
-    file_path = os.path.join("files", "connections", f"{username}_ip.json")
-    if not os.path.exists(file_path):
+    last_connections = await run_blocking(
+        connection_history.recent, username, 5, kind="files"
+    )
+    if not last_connections:
         await callback.answer("Нет данных о подключениях.", show_alert=True)
         return
 
-    async with aiofiles.open(file_path, "r") as f:
-        data = json.loads(await f.read())
-
-    last_connections = sorted(
-        data.items(),
-        key=lambda x: datetime.datetime.strptime(x[1], "%d.%m.%Y %H:%M"),
-        reverse=True,
-    )[:5]
-
-    isp_results = await asyncio.gather(
-        *(get_isp_info(ip) for ip, _ in last_connections)
-    )
+    isp_by_ip = await get_isp_info_many([ip for ip, _ in last_connections])
+    isp_results = [isp_by_ip[ip] for ip, _ in last_connections]
 
     text = f"*Последние подключения {username}:*\n" + "\n".join(
-        f"{ip} ({isp}) - {time}"
-        for (ip, time), isp in zip(last_connections, isp_results)
+        f"{ip} ({isp}) - "
+        f"{datetime.datetime.fromtimestamp(last_seen).strftime('%d.%m.%Y %H:%M')}"
+        for (ip, last_seen), isp in zip(last_connections, isp_results)
     )
 
     keyboard = InlineKeyboardMarkup(
@@ -485,8 +456,11 @@ async def ip_info_callback(callback: CallbackQuery):
         return
 
     username = callback.data.split("ip_info_")[1]
-    active_clients = db.get_active_list()
-    active_info = active_clients.get(username)
+    try:
+        active_info, data_age = await db.get_cached_activity(username)
+    except asyncio.TimeoutError:
+        await callback.answer("Сервер не ответил, попробуйте позже.", show_alert=True)
+        return
 
     if not active_info:
         await callback.answer("Нет данных о подключении.", show_alert=True)
@@ -494,13 +468,15 @@ async def ip_info_callback(callback: CallbackQuery):
 
     ip_address = active_info.endpoint.split(":")[0]
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"http://ip-api.com/json/{ip_address}") as resp:
-            data = await resp.json() if resp.status == 200 else {}
+    data = await ip_api.lookup(ip_address)
 
     text = f"*IP info {username}:*\n" + "\n".join(
         f"{k.capitalize()}: {v}" for k, v in data.items()
     )
+    if active_info.latest_handshake:
+        handshake_age = time.time() - active_info.latest_handshake
+        text += f"\n_Рукопожатие {format_age(handshake_age)} назад_"
+    text += f"\n_Данные обновлены {format_age(data_age)} назад_"
 
     keyboard = InlineKeyboardMarkup(
         inline_keyboard=[
@@ -524,7 +500,7 @@ async def ip_info_callback(callback: CallbackQuery):
 
 @router.message(Command("traffic"))
 async def send_traffic_graph(message: Message):
-    image_buf = get_vnstati_image_to_buffer()
+    image_buf = await run_blocking(get_vnstati_image_to_buffer, kind="stats")
     if not image_buf:
         await message.answer("❌ Не удалось получить данные о трафике.")
         return
@@ -534,7 +510,9 @@ async def send_traffic_graph(message: Message):
 
 @router.message(Command("data"))
 async def send_traffic_graph(message: Message):
-    data = check_wg_show_remote("files/servers.json")
+    data = await run_blocking(
+        check_wg_show_remote, "files/servers.json", timeout=60, kind="ssh"
+    )
     if not data:
         await message.answer("❌ Не удалось получить данные о серверах.")
         return
@@ -545,6 +523,105 @@ async def send_traffic_graph(message: Message):
     )
 
 
+@router.message(Command("deploy"))
+async def deploy_servers_handler(message: Message, command: CommandObject):
+    """Деплой конфигурации на все удалённые ноды с отчётом по каждой.
+    /deploy force — деплой и на ноды, уже получившие текущее поколение."""
+    if message.from_user is None or not is_privileged(message.from_user.id):
+        await message.answer("❌ У вас нет прав для этого действия.")
+        return
+
+    await message.answer("🔄 Начинаю деплой на все сервера из конфигурации...")
+    force = (command.args or "").strip() == "force"
+    report = await run_blocking(
+        deploy_to_all_servers, timeout=DEPLOY_DEADLINE + 30, kind="ssh", force=force
+    )
+    await message.answer(report)
+
+
+@router.message(Command("nodes"))
+async def nodes_status_handler(message: Message):
+    """Поколение конфигурации на каждой ноде и отставание от текущего."""
+    if message.from_user is None or not is_privileged(message.from_user.id):
+        await message.answer("❌ У вас нет прав для этого действия.")
+        return
+
+    statuses = await run_blocking(get_nodes_status, kind="files")
+    if not statuses:
+        await message.answer("Список серверов пуст.")
+        return
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    lines = ["🖥 <b>Ноды:</b>"]
+    for node in statuses:
+        if node.error or node.current is None:
+            lines.append(f"❌ {node.host} — нет локальной конфигурации: {node.error}")
+        elif node.state is None:
+            lines.append(
+                f"⚪️ {node.host} — деплоя не было, "
+                f"текущее поколение {node.current.generation}"
+            )
+        elif node.lag == 0:
+            lines.append(
+                f"✅ {node.host} — поколение {node.state.generation}, "
+                f"деплой {format_age((now - node.state.deployed_at).total_seconds())} назад"
+            )
+        else:
+            lines.append(
+                f"⚠️ {node.host} — поколение {node.state.generation} "
+                f"из {node.current.generation}, отстаёт на {node.lag}, изменения "
+                f"{format_age((now - node.current.created_at).total_seconds())} назад"
+            )
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
+@router.message(Command("bulk_add"))
+async def bulk_add_users(message: Message, command: CommandObject):
+    """Массовое создание клиентов: /bulk_add name1 name2 ... (через пробел, запятую или с новой строки)"""
+    if message.from_user is None or not is_privileged(message.from_user.id):
+        await message.answer("❌ У вас нет прав для этого действия.")
+        return
+
+    names = [name for name in re.split(r"[\s,]+", command.args or "") if name]
+    if not names:
+        await message.answer(
+            "Укажите имена клиентов: /bulk_add name1 name2 ... "
+            "(через пробел, запятую или с новой строки)"
+        )
+        return
+
+    await message.answer(f"⚙️ Создаю {len(names)} клиентов...")
+    peers = await db.provision_many_async(names)
+    if not peers:
+        await message.answer("❌ Не удалось создать ни одного клиента.")
+        return
+
+    created = {peer.name for peer in peers}
+    skipped = [name for name in dict.fromkeys(names) if name not in created]
+    text = f"✅ Создано клиентов: {len(peers)}"
+    if skipped:
+        # Подпись к документу ограничена 1024 символами
+        text += f"\n⚠️ Пропущено ({len(skipped)}): {', '.join(skipped[:30])}"
+        if len(skipped) > 30:
+            text += ", ..."
+
+    await message.answer_document(
+        document=BufferedInputFile(
+            file=build_configs_archive(peers), filename="configs.zip"
+        ),
+        caption=text,
+    )
+
+    # Новые клиенты должны появиться и на удалённых нодах
+    try:
+        report = await run_blocking(
+            deploy_to_all_servers, timeout=DEPLOY_DEADLINE + 30, kind="ssh"
+        )
+    except asyncio.TimeoutError:
+        report = "⚠️ Деплой на удалённые сервера не завершился вовремя, выполните /deploy."
+    await message.answer(report)
+
+
 @router.callback_query(UserConfCallbackFactory.filter())
 async def client_selected_callback(
     callback: CallbackQuery, callback_data: UserConfCallbackFactory
@@ -562,7 +639,7 @@ async def client_selected_callback(
 
     username = callback_data.username
 
-    config = user_db.get_config_by_telegram_id(username)
+    config = await async_user_db.get_config_by_telegram_id(username)
     if not config:
         await callback.message.answer("Конфигурация не найдена")
         return
@@ -1,8 +1,9 @@
+import asyncio
 import os
-from typing import Optional
+from typing import Optional, Set
 from utils import get_instructions_text
 from service.notifier import notify_admins
-from service.user_vpn_check import update_vpn_state
+from service.user_vpn_check import update_vpn_state_async
 from service.vpn_service import create_vpn_config
 import db
 import uuid
@@ -15,13 +16,15 @@ from aiogram.types import CallbackQuery
 
 from keyboard.menu import get_extend_subscription_keyboard, get_instruction_type
 from service.generate_vpn_key import generate_vpn_key
-from service.db_instance import user_db
+from service.db_instance import async_user_db
 from aiogram.types import Message, FSInputFile
 from settings import BOT, YOOKASSA_PROVIDER_TOKEN
 
 
 logger = logging.getLogger(__name__)
 router = Router()
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+_background_tasks: Set[asyncio.Task] = set()
 
 
 @router.callback_query(F.data == "buy_vpn")
@@ -82,7 +85,7 @@ async def handle_extend_subscription(callback: CallbackQuery):
         start_parameter="vpn-subscription",
     )
 
-    user_db.add_payment(
+    await async_user_db.add_payment(
         user_id=telegram_id,
         amount=amount / 100,
         months=month,
@@ -106,13 +109,13 @@ async def process_successful_payment(
 ) -> Optional[int]:
     """Обновление статуса платежа и продление подписки"""
     try:
-        updated_payment = user_db.update_payment_status(
+        updated_payment = await async_user_db.update_payment_status(
             raw_payload, provider_payment_charge_id, new_status="success"
         )
         if not updated_payment:
             return None
 
-        user_db.update_user_end_date(user_id, months_to_add=updated_payment.months)
+        await async_user_db.update_user_end_date(user_id, months_to_add=updated_payment.months)
         return updated_payment.months
     except Exception as e:
         logger.error(f"Ошибка при обработке успешного платежа: {e}", exc_info=True)
@@ -131,6 +134,20 @@ def validate_payment(message: Message) -> Optional[tuple[str, str, str]]:
     )
 
 
+async def update_vpn_state_after_payment(telegram_id: str):
+    """Применяет продление подписки к ключам на серверах в фоне."""
+    try:
+        if await update_vpn_state_async():
+            return
+        error = "ошибка при обновлении ключей"
+    except Exception as e:
+        error = str(e) or type(e).__name__
+    logger.error(f"❌ Не удалось обновить состояние VPN после оплаты {telegram_id}: {error}")
+    await notify_admins(
+        text=f"⚠️ Оплата {telegram_id} принята, но обновить состояние VPN не удалось: {error}"
+    )
+
+
 # 👉 Успешная оплата
 @router.message(F.content_type == ContentType.SUCCESSFUL_PAYMENT)
 async def successful_payment(message: Message):
@@ -153,11 +170,11 @@ async def successful_payment(message: Message):
         logger.info(f"🔁 Подписка продлена на {months} мес. для {telegram_id}")
 
         # Проверяем есть конфигурация или нет
-        clients = db.get_client_list()
-        client_entry = next((c for c in clients if c[0] == str(telegram_id)), None)
+        index = await db.get_peer_index_async()
+        client_entry = index.get_by_name(str(telegram_id))
         if client_entry is None:  # Если нет создаем
             # Проверяем есть она у нас в БД
-            config = user_db.get_config_by_telegram_id(str(telegram_id))
+            config = await async_user_db.get_config_by_telegram_id(str(telegram_id))
             if not config:
                 await message.answer("⚙️ Генерируем VPN-конфигурацию...")
                 await create_vpn_config(telegram_id, message)
@@ -168,7 +185,11 @@ async def successful_payment(message: Message):
                 )
         else:
             await message.answer("🛡 У вас уже есть активная конфигурация.")
-        update_vpn_state()
+        # Синхронизация ключей на серверах может занять минуты — не держим
+        # обработчик оплаты, ошибки сообщаются админам отдельно
+        task = asyncio.create_task(update_vpn_state_after_payment(telegram_id))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
         await notify_admins(
             text=f"🔁 Подписка продлена на {months} мес. для {telegram_id} \n {message.from_user.username} \n {payload}"
         )
@@ -1,7 +1,7 @@
 import logging
 from aiogram import Router, F
 
-from service.db_instance import user_db
+from service.db_instance import async_user_db
 from utils import get_short_name, get_welcome_caption
 from keyboard.menu import get_main_menu_markup, get_user_main_menu
 from aiogram.filters import Command
@@ -26,7 +26,7 @@ async def help_command_handler(message: Message):
         )
     else:
         name = get_short_name(message.from_user)
-        user_db.add_user(str(user_id), name)
+        await async_user_db.add_user(str(user_id), name)
         try:
             photo = FSInputFile("media/logo.png")
             await message.answer_photo(
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date
 from io import BytesIO
 import logging
 import os
@@ -9,7 +9,7 @@ from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import CallbackQuery, Message, BufferedInputFile
 
-from service.db_instance import user_db
+from service.db_instance import async_user_db
 from keyboard.menu import get_user_profile_menu, get_user_profile_menu_expired
 from settings import BOT, VPN_NAME
 
@@ -28,7 +28,7 @@ async def send_user_profile(message: Message | CallbackQuery):
 
     logger.info(f"Пользователь {telegram_id} открыл профиль")
 
-    user = user_db.get_user_by_telegram_id(telegram_id)
+    user = await async_user_db.get_user_by_telegram_id(telegram_id)
 
     if not user:
         await message.answer(
@@ -39,14 +39,9 @@ async def send_user_profile(message: Message | CallbackQuery):
     profile_text = get_profile_text(user)
 
     if not user.is_unlimited:
-        try:
-            end_date_obj = (
-                datetime.strptime(user.end_date, "%Y-%m-%d") if user.end_date else None
-            )
-        except Exception:
-            end_date_obj = None
-
-        if not user.end_date or (end_date_obj and end_date_obj < datetime.now()):
+        end_date_obj = user.end
+
+        if not user.end_date or (end_date_obj and end_date_obj <= date.today()):
             reply_markup = get_user_profile_menu_expired()
         else:
             reply_markup = get_user_profile_menu()
@@ -97,7 +92,7 @@ async def get_vpn_config(callback: CallbackQuery):
         return
 
     user_id = callback.from_user.id
-    config = user_db.get_config_by_telegram_id(str(user_id))
+    config = await async_user_db.get_config_by_telegram_id(str(user_id))
     if not config:
         await callback.answer("Конфигурация не найдена")
         return
@@ -125,7 +120,7 @@ async def delete_user_handler(message: Message):
         return
     username = str(message.from_user.id)
 
-    if db.deactive_user_db(username):
+    if await db.deactive_user_db_async(username):
         shutil.rmtree(os.path.join("users", username), ignore_errors=True)
         await message.answer(f"Пользователь **{username}** удален.")
     else:
@@ -0,0 +1,44 @@
+import threading
+import time
+from typing import Dict, Optional
+
+from service.base_model import ActiveClient
+
+
+class ActivityCache:
+    """Последние данные об активности клиентов со всех нод.
+
+    Заполняется фоновым опросом, обработчики читают его без обращения
+    к контейнеру и нодам."""
+
+    def __init__(self):
+        self._clients: Dict[str, ActiveClient] = {}
+        self._updated_at: Optional[float] = None  # time.monotonic()
+        self._lock = threading.Lock()
+
+    def update(self, clients: Dict[str, ActiveClient]) -> None:
+        with self._lock:
+            self._clients = clients
+            self._updated_at = time.monotonic()
+
+    @property
+    def ready(self) -> bool:
+        return self._updated_at is not None
+
+    def age(self) -> Optional[float]:
+        """Сколько секунд назад получены данные; None — опроса ещё не было."""
+        with self._lock:
+            if self._updated_at is None:
+                return None
+            return time.monotonic() - self._updated_at
+
+    def get_all(self) -> Dict[str, ActiveClient]:
+        with self._lock:
+            return dict(self._clients)
+
+    def get(self, username: str) -> Optional[ActiveClient]:
+        with self._lock:
+            return self._clients.get(username)
+
+
+activity_cache = ActivityCache()
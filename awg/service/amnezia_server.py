@@ -1,138 +1,304 @@
 import json
-from typing import Dict
-from scp import SCPClient  # type: ignore
+import shlex
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
 import os
-import paramiko
 import logging
 
-from service.parse_wg import parse_wg_show_output
-from service.base_model import ActiveClient
+from service.parse_wg import parse_wg_dump_output
+from service.base_model import ActiveClient, NodeLag, NodeResult, NodeState
+from service.node_state import node_states
+from service.ssh_pool import ssh_pool
+from service.wg_config import WgConfig, diff_peers, files_fingerprint, fingerprint_script
+from service.wg_live import (
+    APPLY_FAILED_EXIT_CODE,
+    files_archive,
+    install_files_script,
+    interface_name,
+    remove_peer_script,
+    set_peer_script,
+    syncconf_script,
+)
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
 
-def deploy_to_all_servers(config_path="files/servers.json") -> str:
-    text = "🔄 Начинаю деплой на все сервера из конфигурации..."
+NODE_DEADLINE = 15  # секунд на опрос одной ноды
+DEPLOY_DEADLINE = 120  # секунд на деплой одной ноды
+DELTA_PEER_LIMIT = 50  # больше изменённых пиров — применяем через syncconf
+_node_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="awg-node")
+
+
+def load_servers(config_path: str = "files/servers.json") -> List[dict]:
     with open(config_path, "r") as f:
-        servers = json.load(f)
+        return json.load(f)
+
+
+def _timed_call(
+    func: Callable[[dict], T], server: dict
+) -> Tuple[Optional[T], NodeResult]:
+    started = time.monotonic()
+    try:
+        value, error = func(server), ""
+    except Exception as e:
+        value, error = None, str(e) or type(e).__name__
+    result = NodeResult(
+        host=server["ssh_host"],
+        ok=not error,
+        elapsed=time.monotonic() - started,
+        error=error,
+    )
+    return value, result
 
-    for server in servers:
-        text += f"\n- {server['ssh_host']}"
-        logger.info(f"Deploying to {server['ssh_host']}...")
-        deploy_and_exec(server)
-        text += f"\n✅ Деплой на {server['ssh_host']} завершен."
-        logger.info(f"Deployment to {server['ssh_host']} completed.")
 
+def fan_out(
+    servers: List[dict], func: Callable[[dict], T], deadline: float
+) -> Tuple[Dict[str, T], List[NodeResult]]:
+    """Вызывает func(server) для всех нод параллельно.
+
+    Возвращает результаты нод, уложившихся в deadline (None от func в них
+    не попадает), и отчёт по каждой ноде. Опоздавшие ноды попадают в отчёт как ошибки; их вызовы
+    дорабатывают в фоне, результат отбрасывается."""
+    futures = {
+        _node_executor.submit(_timed_call, func, server): server
+        for server in servers
+    }
+    done, _ = wait(futures, timeout=deadline)
+
+    values: Dict[str, T] = {}
+    report: List[NodeResult] = []
+    for future, server in futures.items():
+        if future not in done:
+            future.cancel()
+            logger.error(f"❌ Сервер {server['ssh_host']} не ответил за {deadline} с")
+            report.append(
+                NodeResult(
+                    host=server["ssh_host"],
+                    ok=False,
+                    elapsed=deadline,
+                    error=f"нет ответа за {deadline} с",
+                )
+            )
+            continue
+        value, result = future.result()
+        if not result.ok:
+            logger.error(f"❌ Ошибка на сервере {result.host}: {result.error}")
+        elif value is not None:
+            values[result.host] = value
+        report.append(result)
+    return values, report
+
+
+def format_node_report(report: List[NodeResult]) -> str:
+    lines = []
+    for result in report:
+        if result.ok:
+            detail = f", {result.detail}" if result.detail else ""
+            lines.append(f"✅ {result.host} — {result.elapsed:.1f} с{detail}")
+        else:
+            lines.append(f"❌ {result.host} — {result.error}")
+    return "\n".join(lines)
+
+
+def deploy_to_all_servers(config_path="files/servers.json", force=False) -> str:
+    """Деплой на все ноды. Ноды, уже получившие текущее поколение
+    конфигурации, пропускаются, если не задан force."""
+    servers = load_servers(config_path)
+    logger.info(f"Deploying to {len(servers)} servers...")
+    details, report = fan_out(
+        servers,
+        lambda server: deploy_and_exec(server, force=force),
+        DEPLOY_DEADLINE,
+    )
+    for result in report:
+        result.detail = details.get(result.host, "")
+    failed = sum(1 for result in report if not result.ok)
+    logger.info(f"Deployment completed, failed: {failed}.")
+
+    text = "🔄 Деплой на сервера из конфигурации:\n" + format_node_report(report)
+    if failed:
+        return text + f"\n⚠️ Деплой не выполнен на {failed} из {len(report)} серверов."
     return text + "\n✅ Деплой на все сервера завершен."
 
 
-def deploy_and_exec(server_config):
-    """Загружает конфигурацию сервера и выполняет деплой."""
+def delta_apply_script(
+    old_config: str, new_config: str, config_file: str
+) -> Optional[Tuple[str, str]]:
+    """Команды wg set, переводящие интерфейс из old_config в new_config;
+    config_file — путь к уже записанному new_config на ноде.
+
+    Возвращает (скрипт, описание) или None, если нужна полная
+    синхронизация: изменилась секция [Interface], у добавленного или
+    изменённого пира нет PresharedKey или изменений слишком много для
+    поштучного применения."""
+    old, new = WgConfig.parse(old_config), WgConfig.parse(new_config)
+    if [line.strip() for line in old.interface_lines] != [
+        line.strip() for line in new.interface_lines
+    ]:
+        return None
+
+    iface = interface_name(config_file)
+    added, changed, removed = diff_peers(old, new)
+    if len(added) + len(changed) + len(removed) > DELTA_PEER_LIMIT:
+        return None
+    if any(not block.preshared_key for block in added + changed):
+        return None
+
+    commands = [
+        set_peer_script(
+            iface,
+            block.public_key,
+            allowed_ips=block.allowed_ips,
+            config_file=config_file,
+        )
+        for block in added + changed
+    ]
+    commands += [remove_peer_script(iface, public_key) for public_key in removed]
+    summary = f"изменения: +{len(added)} ~{len(changed)} -{len(removed)}"
+    return " && ".join(commands) or "true", summary
+
+
+def get_remote_files_fingerprint(server_config: dict) -> str:
+    docker_container = server_config["docker_container"]
+    remote_docker_path = server_config["remote_docker_path"]
+    script = fingerprint_script(
+        [
+            os.path.join(remote_docker_path, "wg0.conf"),
+            os.path.join(remote_docker_path, "ClientsTable"),
+        ]
+    )
+    cmd = f"docker exec -i {docker_container} sh -c {shlex.quote(script)}"
+    status, output, _ = ssh_pool.run(server_config, cmd)
+    if status != 0:
+        return ""
+    return output.strip()
+
+
+def deploy_and_exec(server_config, force=False) -> str:
+    """Доставляет wg0.conf и ClientsTable на ноду и применяет их без перезапуска.
+
+    Если файлы на ноде совпадают с последним развёрнутым состоянием, на
+    интерфейс отправляются только добавленные, изменённые и удалённые пиры.
+    При расхождении (нода менялась вручную или состояние неизвестно)
+    выполняется полная синхронизация через wg syncconf; docker restart
+    остаётся крайней мерой, если живое применение не удалось. Нода, уже
+    получившая текущее поколение конфигурации, не опрашивается.
+    Возвращает краткое описание выполненного деплоя."""
     ssh_host = server_config["ssh_host"]
-    ssh_port = server_config["ssh_port"]
-    ssh_user = server_config["ssh_user"]
-    ssh_key_path = os.path.expanduser(server_config["ssh_key_path"])
     local_wg0 = server_config["local_wg0"]
     local_clients_table = server_config["local_clientsTable"]
-    remote_tmp_dir = server_config["remote_tmp_dir"]
     docker_container = server_config["docker_container"]
     remote_docker_path = server_config["remote_docker_path"]
 
-    wg_config_file = os.path.join(remote_docker_path, "wg0.conf")
-
-    # Устанавливаем SSH-соединение
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(
-        hostname=ssh_host, port=ssh_port, username=ssh_user, key_filename=ssh_key_path
+    remote_wg0 = os.path.join(remote_docker_path, "wg0.conf")
+    remote_clients_table = os.path.join(remote_docker_path, "ClientsTable")
+
+    with open(local_wg0, "r") as f:
+        config = f.read()
+    with open(local_clients_table, "r") as f:
+        clients_table_raw = f.read()
+    fingerprint = files_fingerprint(config, clients_table_raw)
+    generation = node_states.current_generation(local_wg0, fingerprint).generation
+
+    known = node_states.get(ssh_host)
+    if (
+        not force
+        and known is not None
+        and known.generation == generation
+        and known.fingerprint == fingerprint
+    ):
+        return f"поколение {generation}, уже актуально"
+
+    remote_fingerprint = get_remote_files_fingerprint(server_config)
+    if remote_fingerprint == fingerprint:
+        detail = "без изменений"
+    else:
+        delta = None
+        if known is not None and known.fingerprint == remote_fingerprint:
+            delta = delta_apply_script(known.config, config, remote_wg0)
+        if delta is None:
+            apply_script, detail = syncconf_script(remote_wg0), "полная синхронизация"
+        else:
+            apply_script, detail = delta
+
+        script = "set -e; " + install_files_script(
+            {"wg0.conf": remote_wg0, "ClientsTable": remote_clients_table},
+            f"( {apply_script} ) || exit {APPLY_FAILED_EXIT_CODE}",
+        )
+        status, _, errors = ssh_pool.run(
+            server_config,
+            f"docker exec -i {docker_container} sh -c {shlex.quote(script)}",
+            input=files_archive(
+                {"wg0.conf": config, "ClientsTable": clients_table_raw}
+            ),
+        )
+        if status == APPLY_FAILED_EXIT_CODE:
+            # Файлы на месте, но интерфейс не принял изменения
+            logger.warning(
+                f"⚠️ Не удалось применить конфигурацию на {ssh_host}: {errors}"
+            )
+            status, _, errors = ssh_pool.run(
+                server_config, f"docker restart {docker_container}"
+            )
+            detail += ", docker restart"
+        if status != 0:
+            raise RuntimeError(errors.strip() or f"код выхода {status}")
+
+    node_states.put(
+        NodeState(
+            host=ssh_host,
+            fingerprint=fingerprint,
+            config=config,
+            deployed_at=datetime.now(timezone.utc),
+            generation=generation,
+        )
     )
+    logger.info(f"Deployment to {ssh_host}: {detail}, generation {generation}.")
+    return f"поколение {generation}, {detail}"
 
-    # Создаём временную директорию на сервере
-    ssh.exec_command(f"mkdir -p {remote_tmp_dir}")
 
-    # Копируем файлы во временную директорию на сервере
-    with SCPClient(ssh.get_transport()) as scp:
-        scp.put(local_wg0, remote_path=os.path.join(remote_tmp_dir, "wg0.conf"))
-        scp.put(
-            local_clients_table,
-            remote_path=os.path.join(remote_tmp_dir, "ClientsTable"),
+def get_nodes_status(config_path="files/servers.json") -> List[NodeLag]:
+    """Поколение конфигурации на каждой ноде относительно текущего."""
+    statuses = []
+    for server in load_servers(config_path):
+        ssh_host = server["ssh_host"]
+        try:
+            with open(server["local_wg0"], "r") as f:
+                config = f.read()
+            with open(server["local_clientsTable"], "r") as f:
+                clients_table_raw = f.read()
+        except OSError as e:
+            statuses.append(NodeLag(host=ssh_host, error=str(e)))
+            continue
+        current = node_states.peek_generation(
+            server["local_wg0"], files_fingerprint(config, clients_table_raw)
         )
-
-    # Копируем файлы из временной директории в Docker-контейнер
-    file_mappings = {
-        "wg0.conf": os.path.join(remote_docker_path, "wg0.conf"),
-        "ClientsTable": os.path.join(remote_docker_path, "ClientsTable"),
-    }
-
-    for filename, container_path in file_mappings.items():
-        remote_file_path = os.path.join(remote_tmp_dir, filename)
-        cmd_copy = f"docker cp {remote_file_path} {docker_container}:{container_path}"
-        ssh.exec_command(cmd_copy)
-
-    # Перезапуск WireGuard внутри контейнера
-    cmd_restart = f"docker restart {docker_container}"
-    ssh.exec_command(cmd_restart)
-
-    # Закрываем SSH-соединение
-    ssh.close()
+        statuses.append(
+            NodeLag(host=ssh_host, current=current, state=node_states.get(ssh_host))
+        )
+    return statuses
 
 
 def check_wg_show_remote(servers_json_path: str) -> str:
-    with open(servers_json_path, "r") as f:
-        servers = json.load(f)
-
-    for server in servers:
-        logger.info(f"\n🔄 Проверка сервера: {server['ssh_host']}")
-        try:
-            ssh_key_path = os.path.expanduser(server["ssh_key_path"])
-
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh.connect(
-                hostname=server["ssh_host"],
-                port=server.get("ssh_port", 22),
-                username=server["ssh_user"],
-                key_filename=ssh_key_path,
-            )
-
-            cmd = f"docker exec -i {server['docker_container']} wg show"
-
-            stdin, stdout, stderr = ssh.exec_command(cmd)
-            output = stdout.read().decode()
-            errors = stderr.read().decode()
-
-            if output:
-                logger.info(f"✅ Результат:\n{output}")
-            if errors:
-                logger.warning(f"⚠️ Ошибки:\n{errors}")
-
-            ssh.close()
-            return output
-        except Exception as e:
-            logger.error(f"❌ Ошибка при подключении к {server['ssh_host']}: {e}")
-            return f"❌ Ошибка при подключении к {server['ssh_host']}: {e}"
+    servers = load_servers(servers_json_path)
+    outputs, report = fan_out(servers, get_wg_show_output, NODE_DEADLINE)
+    if not outputs:
+        logger.error("❌ Не удалось подключиться ни к одному серверу.")
+        report_text = format_node_report(report)
+        return f"❌ Не удалось подключиться ни к одному серверу.\n{report_text}"
 
-    logger.error("❌ Не удалось подключиться ни к одному серверу.")
-    return "❌ Не удалось подключиться ни к одному серверу."
+    sections = [f"== {host} ==\n{output}" for host, output in outputs.items()]
+    return "\n".join(sections) + "\n" + format_node_report(report)
 
 
-def get_wg_show_output(server: dict) -> str:
-    import paramiko
-
-    ssh_key_path = os.path.expanduser(server["ssh_key_path"])
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(
-        hostname=server["ssh_host"],
-        port=server.get("ssh_port", 22),
-        username=server["ssh_user"],
-        key_filename=ssh_key_path,
-    )
+def get_wg_show_output(server: dict, dump: bool = False) -> str:
     cmd = f"docker exec -i {server['docker_container']} wg show"
-    stdin, stdout, stderr = ssh.exec_command(cmd)
-    output = stdout.read().decode()
-    errors = stderr.read().decode()
-    ssh.close()
+    if dump:
+        cmd += " all dump"
+    _, output, errors = ssh_pool.run(server, cmd)
 
     if errors:
         logger.warning(f"⚠️ Ошибка в выводе команды на {server['ssh_host']}: {errors}")
@@ -143,30 +309,34 @@ def get_wg_show_output(server: dict) -> str:
 def get_remote_active_clients(
     client_key_map: Dict[str, str], servers_json_path: str = "files/servers.json"
 ) -> Dict[str, ActiveClient]:
-    import paramiko
-
-    active_clients: Dict[str, ActiveClient] = {}
+    active_clients, _ = get_remote_active_clients_report(
+        client_key_map, servers_json_path
+    )
+    return active_clients
 
-    with open(servers_json_path, "r") as f:
-        servers = json.load(f)
 
-    for server in servers:
-        server_name = server["ssh_host"]
-        logger.info(f"\n🔄 Проверка сервера: {server_name}")
-        try:
-            output = get_wg_show_output(server)
-            if not output:
-                logger.warning(f"⚠️ Пустой вывод wg show на сервере {server_name}")
-                continue
+def get_remote_active_clients_report(
+    client_key_map: Dict[str, str], servers_json_path: str = "files/servers.json"
+) -> Tuple[Dict[str, ActiveClient], List[NodeResult]]:
+    """Опрашивает все ноды параллельно; медленные ноды не задерживают
+    остальные дольше NODE_DEADLINE."""
+    outputs, report = fan_out(
+        load_servers(servers_json_path),
+        lambda server: get_wg_show_output(server, dump=True),
+        NODE_DEADLINE,
+    )
 
-            clients_on_server = parse_wg_show_output(output, client_key_map)
+    active_clients: Dict[str, ActiveClient] = {}
+    for server_name, output in outputs.items():
+        if not output:
+            logger.warning(f"⚠️ Пустой вывод wg show на сервере {server_name}")
+            continue
 
-            # 🧩 Дополняем объект информацией о сервере
-            for username, client in clients_on_server.items():
-                client.server = server_name  # ➕ добавили информацию о сервере
-                active_clients[username] = client
+        clients_on_server = parse_wg_dump_output(output, client_key_map)
 
-        except Exception as e:
-            logger.error(f"❌ Ошибка при подключении к {server_name}: {e}")
+        # 🧩 Дополняем объект информацией о сервере
+        for username, client in clients_on_server.items():
+            client.server = server_name  # ➕ добавили информацию о сервере
+            active_clients[username] = client
 
-    return active_clients
+    return active_clients, report
@@ -1,5 +1,19 @@
+from datetime import date, datetime, timedelta
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, List, Optional
+
+from service.wg_config import client_map_from_table
+
+EPOCH_DATE = date(1970, 1, 1)
+
+
+def date_to_day(value: date) -> int:
+    """Номер дня от 1970-01-01: в таком виде users.end_day хранится в базе."""
+    return (value - EPOCH_DATE).days
+
+
+def day_to_date(day: int) -> date:
+    return EPOCH_DATE + timedelta(days=day)
 
 
 class YoomoneyModel(BaseModel):
@@ -19,9 +33,14 @@ class UserData(BaseModel):
     user_id: int
     telegram_id: str
     name: Optional[str]
-    end_date: Optional[str]
+    end_date: Optional[str]  # "%Y-%m-%d", для отображения
     is_unlimited: int
     has_used_trial: int
+    end_day: Optional[int] = None  # день окончания, см. date_to_day
+
+    @property
+    def end(self) -> Optional[date]:
+        return day_to_date(self.end_day) if self.end_day is not None else None
 
 
 class Config(BaseModel):
@@ -66,19 +85,85 @@ class Payment(BaseModel):
     unique_payload: Optional[str] = None
 
 
-class PeerData(BaseModel):
-    public_key: Optional[str] = None
-    endpoint: Optional[str] = "Нет данных"
-    latest_handshake: Optional[str] = "Нет данных"
-    transfer: Optional[str] = "Нет данных"
+class NodeResult(BaseModel):
+    """Итог операции на одной удалённой ноде."""
+
+    host: str
+    ok: bool
+    elapsed: float  # секунд
+    error: str = ""
+    detail: str = ""
+
+
+class ConfigGeneration(BaseModel):
+    """Номер версии локальной конфигурации, раздаваемой на ноды."""
+
+    source: str  # путь к локальному wg0.conf
+    generation: int
+    fingerprint: str
+    created_at: datetime
+
+
+class NodeState(BaseModel):
+    """Конфигурация, последней развёрнутая на удалённой ноде."""
+
+    host: str
+    fingerprint: str  # files_fingerprint(wg0.conf, ClientsTable)
+    config: str
+    deployed_at: datetime
+    generation: int = 0
 
-    def is_active(self) -> bool:
-        handshake = (self.latest_handshake or "").lower()
-        return handshake not in {"never", "нет данных", "-"}
+
+class NodeLag(BaseModel):
+    """Отставание ноды от текущего поколения конфигурации."""
+
+    host: str
+    current: Optional[ConfigGeneration] = None
+    state: Optional[NodeState] = None
+    error: str = ""
+
+    @property
+    def lag(self) -> Optional[int]:
+        """Сколько поколений нода не получила; None — деплоя ещё не было."""
+        if self.current is None or self.state is None:
+            return None
+        if self.state.fingerprint == self.current.fingerprint:
+            return 0
+        return max(self.current.generation - self.state.generation, 1)
 
 
 class ActiveClient(BaseModel):
-    last_time: str
-    transfer: str
     endpoint: str
     server: Optional[str] = None
+    latest_handshake: int = 0  # unix time последнего рукопожатия
+    rx_bytes: int = 0
+    tx_bytes: int = 0
+
+
+class WgPeer(BaseModel):
+    name: str = "Unknown"
+    public_key: str = ""
+    preshared_key: Optional[str] = None
+    allowed_ips: str = ""
+
+
+class ServerSnapshot(BaseModel):
+    """wg0.conf, clientsTable и вывод wg show all dump, полученные за один docker exec."""
+
+    config: str
+    clients_table: List[dict]
+    wg_dump: str
+    fingerprint: str  # sha256 wg0.conf + sha256 clientsTable, как у sha256sum
+    taken_at: datetime
+
+    def client_map(self) -> Dict[str, str]:
+        """public_key -> clientName из clientsTable."""
+        return client_map_from_table(self.clients_table)
+
+
+class ProvisionedPeer(BaseModel):
+    name: str
+    address: str
+    public_key: str
+    preshared_key: str
+    client_config: str  # готовый клиентский .conf
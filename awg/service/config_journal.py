@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import List
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_DIR = "files/journal"
+
+
+class ConfigConflictError(Exception):
+    """wg0.conf/clientsTable изменились на сервере после чтения снимка."""
+
+
+class ConfigTransaction(BaseModel):
+    """Запись журнала: полное новое содержимое обоих файлов и отпечатки
+    состояния до и после записи."""
+
+    txid: str
+    base_fingerprint: str
+    fingerprint: str
+    config: str
+    clients_table_raw: str
+    apply_script: str = ""
+    created_at: datetime
+
+
+class ConfigJournal:
+    """Журнал предзаписи для коммитов конфигурации WireGuard.
+
+    Транзакция сохраняется на диск до обращения к контейнеру и удаляется
+    после успешной записи. Оставшиеся записи означают прерванный коммит и
+    доигрываются при старте бота."""
+
+    def __init__(self, directory: str = JOURNAL_DIR):
+        self.directory = directory
+
+    def begin(
+        self,
+        base_fingerprint: str,
+        fingerprint: str,
+        config: str,
+        clients_table_raw: str,
+        apply_script: str = "",
+    ) -> ConfigTransaction:
+        tx = ConfigTransaction(
+            txid=datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+            + "-"
+            + uuid.uuid4().hex[:8],
+            base_fingerprint=base_fingerprint,
+            fingerprint=fingerprint,
+            config=config,
+            clients_table_raw=clients_table_raw,
+            apply_script=apply_script,
+            created_at=datetime.now(timezone.utc),
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(tx.txid)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(tx.model_dump_json())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return tx
+
+    def finish(self, tx: ConfigTransaction) -> None:
+        try:
+            os.remove(self._path(tx.txid))
+        except FileNotFoundError:
+            pass
+
+    def pending(self) -> List[ConfigTransaction]:
+        """Незавершённые транзакции в порядке создания."""
+        if not os.path.isdir(self.directory):
+            return []
+        transactions = []
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                with open(path, "r") as f:
+                    transactions.append(ConfigTransaction(**json.load(f)))
+            except (json.JSONDecodeError, ValueError) as e:
+                logger.error(f"Повреждённая запись журнала {path}: {e}")
+                os.replace(path, f"{path}.broken")
+        return transactions
+
+    def _path(self, txid: str) -> str:
+        return os.path.join(self.directory, f"{txid}.json")
@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+LEGACY_CONNECTIONS_DIR = "files/connections"
+LEGACY_TIMESTAMP_FORMAT = "%d.%m.%Y %H:%M"
+FLUSH_INTERVAL = 60  # секунд между записями накопленной истории
+DEDUP_WINDOW = 60  # секунд, в течение которых повторная отметка не пишется
+
+
+class ConnectionHistory:
+    """История IP-адресов подключений клиентов с отложенной записью в
+    таблицу connections.
+
+    record() только обновляет буфер в памяти: повторные отметки одного
+    адреса схлопываются, а адрес, записанный меньше DEDUP_WINDOW секунд
+    назад, в буфер не попадает. flush() сохраняет буфер одной транзакцией."""
+
+    def __init__(self):
+        # (username, ip) -> [first_seen, last_seen]
+        self._pending: Dict[Tuple[str, str], List[int]] = {}
+        self._last_written: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def _db(self):
+        # Импорт при первом обращении: модуль подключается из parse_wg
+        # раньше, чем settings и база данных готовы к импорту
+        from service.db_instance import user_db
+
+        return user_db
+
+    def record(self, username: str, endpoint: str) -> None:
+        key = (username, endpoint.split(":")[0])
+        now = int(time.time())
+        with self._lock:
+            if key in self._pending:
+                self._pending[key][1] = now
+            elif now - self._last_written.get(key, 0) >= DEDUP_WINDOW:
+                self._pending[key] = [now, now]
+
+    def flush(self) -> int:
+        """Записывает накопленные отметки; возвращает их количество."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        rows = [
+            (username, ip, first, last)
+            for (username, ip), (first, last) in pending.items()
+        ]
+        try:
+            self._db.record_connections(rows)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить историю подключений: {e}")
+            with self._lock:
+                for key, (first, last) in pending.items():
+                    current = self._pending.setdefault(key, [first, last])
+                    current[0] = min(current[0], first)
+            return 0
+
+        with self._lock:
+            for key, (_, last) in pending.items():
+                self._last_written[key] = last
+        logger.info(f"История подключений записана: {len(rows)} адресов.")
+        return len(rows)
+
+    def recent(self, username: str, limit: int = 5) -> List[Tuple[str, int]]:
+        """Последние адреса клиента [(ip, last_seen), ...] с учётом ещё не
+        записанных отметок."""
+        latest = dict(self._db.get_recent_connections(username, limit))
+        with self._lock:
+            for (name, ip), (_, last) in self._pending.items():
+                if name == username:
+                    latest[ip] = max(latest.get(ip, 0), last)
+        return sorted(latest.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def prune(self, retention_days: int) -> int:
+        """Удаляет адреса, не встречавшиеся дольше retention_days дней."""
+        cutoff = int(time.time()) - retention_days * 86400
+        removed = self._db.prune_connections(cutoff)
+        with self._lock:
+            self._last_written = {
+                key: last for key, last in self._last_written.items() if last >= cutoff
+            }
+        logger.info(f"Удалено устаревших адресов подключений: {removed}.")
+        return removed
+
+    def import_legacy_files(self, directory: str = LEGACY_CONNECTIONS_DIR) -> None:
+        """Переносит старые files/connections/<user>_ip.json в таблицу и
+        переименовывает каталог, чтобы перенос выполнялся один раз."""
+        if not os.path.isdir(directory):
+            return
+        rows = []
+        for filename in os.listdir(directory):
+            if not filename.endswith("_ip.json"):
+                continue
+            username = filename[: -len("_ip.json")]
+            try:
+                with open(os.path.join(directory, filename), "r") as f:
+                    data = json.load(f)
+                for ip, timestamp in data.items():
+                    seen = int(
+                        datetime.strptime(timestamp, LEGACY_TIMESTAMP_FORMAT).timestamp()
+                    )
+                    rows.append((username, ip, seen, seen))
+            except (OSError, ValueError) as e:
+                logger.error(f"Пропущен файл истории подключений {filename}: {e}")
+        if rows:
+            self._db.record_connections(rows)
+        logger.info(f"История подключений перенесена в базу: {len(rows)} адресов.")
+        target = f"{directory}.imported"
+        if os.path.exists(target):
+            target = f"{target}.{int(time.time())}"
+        try:
+            os.replace(directory, target)
+        except OSError as e:
+            # Повторный перенос безопасен: record_connections объединяет отметки
+            logger.error(f"Не удалось переименовать {directory} в {target}: {e}")
+
+
+connection_history = ConnectionHistory()
@@ -1,3 +1,4 @@
 from service import db_user
 
 user_db = db_user.Database()
+async_user_db = db_user.AsyncDatabase(user_db)
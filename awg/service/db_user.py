@@ -1,14 +1,162 @@
+import asyncio
+import functools
 import logging
-from datetime import datetime, timedelta
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
 import sqlite3
-from typing import List, Literal, Optional, Union
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Literal, Optional, Tuple, TypeVar, Union
+from urllib.request import pathname2url
 from dateutil.relativedelta import relativedelta
 
-from settings import DB_FILE
-from service.base_model import Payment, UserData, Config
+from settings import DB_FILE, DB_PRAGMAS, DB_READ_CONNECTIONS
+from service.base_model import Payment, UserData, Config, date_to_day
 
 logger = logging.getLogger(__name__)
 
+F = TypeVar("F", bound=Callable[..., Any])
+
+SYNCHRONOUS_LEVELS = {"off": 0, "normal": 1, "full": 2, "extra": 3}
+# Сколько ждать свободное читающее соединение, прежде чем считать пул зависшим
+READ_ACQUIRE_TIMEOUT = 30  # секунд
+
+# Состояния пользователей для iter_users_with_configs
+USER_STATE_ACTIVE = "active"
+USER_STATE_EXPIRED = "expired"
+# Столбцы configs в порядке полей Config
+CONFIG_COLUMNS = (
+    "config_id", "user_id",
+    "private_key", "address", "dns",
+    "jc", "jmin", "jmax",
+    "s1", "s2",
+    "h1", "h2", "h3", "h4",
+    "public_key", "preshared_key",
+    "allowed_ips", "endpoint", "persistent_keepalive",
+    "deactivate_presharekey",
+)
+
+# Миграции схемы: (версия, описание, SQL). Применяются по порядку к базе,
+# у которой PRAGMA user_version меньше версии миграции; номера не меняются
+# и не переиспользуются, новая миграция добавляется в конец списка.
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (
+        1,
+        "индексы для выборок по сроку подписки, платежам и конфигурациям",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_users_end_date ON users (end_date)",
+            "CREATE INDEX IF NOT EXISTS idx_users_is_unlimited ON users (is_unlimited)",
+            "CREATE INDEX IF NOT EXISTS idx_payments_raw_payload ON payments (raw_payload)",
+            "CREATE INDEX IF NOT EXISTS idx_payments_user_id ON payments (user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_configs_user_id ON configs (user_id)",
+        ],
+    ),
+    (
+        2,
+        "users.end_day: срок подписки номером дня для выборок по диапазону",
+        [
+            "ALTER TABLE users ADD COLUMN end_day INTEGER",
+            # julianday('1970-01-01') = 2440587.5; для некорректных строк NULL
+            """
+            UPDATE users
+            SET end_day = CAST(julianday(end_date) - 2440587.5 AS INTEGER)
+            WHERE end_date IS NOT NULL
+            """,
+            "DROP INDEX IF EXISTS idx_users_end_date",
+            "CREATE INDEX IF NOT EXISTS idx_users_end_day ON users (end_day)",
+        ],
+    ),
+    (
+        3,
+        "триггеры: end_day пересчитывается при любой записи end_date",
+        [
+            """
+            CREATE TRIGGER IF NOT EXISTS users_end_day_insert
+            AFTER INSERT ON users
+            BEGIN
+                UPDATE users
+                SET end_day = CAST(julianday(NEW.end_date) - 2440587.5 AS INTEGER)
+                WHERE user_id = NEW.user_id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS users_end_day_update
+            AFTER UPDATE OF end_date ON users
+            BEGIN
+                UPDATE users
+                SET end_day = CAST(julianday(NEW.end_date) - 2440587.5 AS INTEGER)
+                WHERE user_id = NEW.user_id;
+            END
+            """,
+            # Строки, у которых end_date менялся в обход update_user_end_date
+            "UPDATE users SET end_day = CAST(julianday(end_date) - 2440587.5 AS INTEGER)",
+        ],
+    ),
+]
+
+
+def apply_pragmas(conn: sqlite3.Connection, pragmas: Dict[str, Any]) -> None:
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+def verify_pragmas(conn: sqlite3.Connection, pragmas: Dict[str, Any]) -> List[str]:
+    """Сверяет действующие PRAGMA с заданными; возвращает расхождения.
+
+    SQLite молча игнорирует часть значений: WAL недоступен на сетевых ФС,
+    mmap_size ограничен при сборке библиотеки."""
+    mismatches = []
+    for name, expected in pragmas.items():
+        actual = conn.execute(f"PRAGMA {name}").fetchone()[0]
+        if name == "synchronous" and isinstance(expected, str):
+            expected = SYNCHRONOUS_LEVELS.get(expected.lower(), expected)
+        if isinstance(expected, str):
+            matches = str(actual).lower() == expected.lower()
+        else:
+            matches = actual == expected
+        if not matches:
+            mismatches.append(f"{name}={actual} (ожидалось {expected})")
+    return mismatches
+
+
+def inserted_id(cursor: sqlite3.Cursor) -> int:
+    """ID строки, вставленной последним INSERT курсора."""
+    if cursor.lastrowid is None:
+        raise sqlite3.DatabaseError("INSERT не вернул ID новой строки.")
+    return cursor.lastrowid
+
+
+def serialized(method: F) -> F:
+    """Выполняет метод Database под блокировкой соединения: обращения из
+    разных потоков не перемешивают транзакции."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper  # type: ignore[return-value]
+
+
+def reads(method: F) -> F:
+    """Выполняет читающий метод Database на соединении из пула читателей:
+    чтения идут параллельно друг с другом и с записью (WAL)."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if getattr(self._local, "conn", None) is not None:
+            return method(self, *args, **kwargs)  # вложенный вызов
+        with self.read_connection() as conn:
+            self._local.conn = conn
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self._local.conn = None
+
+    wrapper.reads = True  # type: ignore[attr-defined]
+    return wrapper  # type: ignore[return-value]
+
 
 # =====================================================================
 # Интегрированный класс Database для управления пользователями и конфигурациями VPN
@@ -16,14 +164,70 @@ logger = logging.getLogger(__name__)
 
 
 class Database:
-    def __init__(self, db_path=DB_FILE):
+    """Единственное записывающее соединение и пул соединений только для
+    чтения к одному файлу базы."""
+
+    def __init__(
+        self,
+        db_path=DB_FILE,
+        pragmas: Dict[str, Any] = DB_PRAGMAS,
+        read_connections: int = DB_READ_CONNECTIONS,
+    ):
+        self.db_path = db_path
+        self.pragmas = pragmas
         self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.cursor = self.conn.cursor()
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        apply_pragmas(self.conn, pragmas)
+        self._check_pragmas(self.conn, pragmas, "записи")
         self.create_tables()
+        self.migrate()
+
+        self.read_connections = read_connections
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        for _ in range(read_connections):
+            self._readers.put(self._open_reader())
+
+    @staticmethod
+    def _check_pragmas(conn: sqlite3.Connection, pragmas: Dict[str, Any], role: str):
+        mismatches = verify_pragmas(conn, pragmas)
+        if mismatches:
+            logger.warning(
+                f"PRAGMA соединения {role} не применились: {', '.join(mismatches)}"
+            )
 
+    def _open_reader(self) -> sqlite3.Connection:
+        uri = f"file:{pathname2url(self.db_path)}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        # journal_mode хранится в самом файле и задаётся писателем
+        pragmas = {k: v for k, v in self.pragmas.items() if k != "journal_mode"}
+        pragmas["query_only"] = 1
+        apply_pragmas(conn, pragmas)
+        self._check_pragmas(conn, pragmas, "чтения")
+        return conn
+
+    @contextmanager
+    def read_connection(self) -> Iterator[sqlite3.Connection]:
+        """Выдаёт свободное соединение только для чтения на время блока."""
+        if not self.read_connections:
+            with self._lock:
+                yield self.conn
+            return
+        conn = self._readers.get(timeout=READ_ACQUIRE_TIMEOUT)
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def _read_cursor(self) -> sqlite3.Cursor:
+        conn = getattr(self._local, "conn", None)
+        return (conn or self.conn).cursor()
+
+    @serialized
     def create_tables(self):
         """Создает таблицы для пользователей и конфигураций VPN, если они отсутствуют."""
-        self.cursor.execute(
+        cursor = self.conn.cursor()
+        cursor.execute(
             """
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY,
@@ -35,7 +239,7 @@ class Database:
             )
         """
         )
-        self.cursor.execute(
+        cursor.execute(
             """
             CREATE TABLE IF NOT EXISTS configs (
                 config_id INTEGER PRIMARY KEY,
@@ -71,7 +275,7 @@ class Database:
             )
         """
         )
-        self.cursor.execute(
+        cursor.execute(
             """
             CREATE TABLE IF NOT EXISTS payments (
                 payment_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -86,22 +290,68 @@ class Database:
                 FOREIGN KEY (user_id) REFERENCES users(user_id)
             )
 """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS connections (
+                username TEXT NOT NULL,  -- имя клиента в wg0.conf
+                ip TEXT NOT NULL,
+                first_seen INTEGER NOT NULL,  -- unix time
+                last_seen INTEGER NOT NULL,
+                PRIMARY KEY (username, ip)
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_connections_username_last_seen
+            ON connections (username, last_seen)
+        """
         )
         self.conn.commit()
 
+    @serialized
+    def schema_version(self) -> int:
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    @serialized
+    def migrate(self) -> int:
+        """Применяет недостающие миграции, каждую в своей транзакции вместе с
+        новым user_version; возвращает итоговую версию схемы."""
+        version = self.schema_version()
+        for target, description, statements in MIGRATIONS:
+            if target <= version:
+                continue
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute("BEGIN")
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(f"PRAGMA user_version = {target}")
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                logger.exception(f"Миграция схемы {target} ({description}) не применена.")
+                raise
+            logger.info(f"Схема базы обновлена до версии {target}: {description}.")
+            version = target
+        return version
+
+    @reads
     def get_user_by_telegram_id(
         self, telegram_id: str
     ) -> Union[UserData, Literal[False]]:
         """Возвращает пользователя по telegram_id или False, если не найден."""
-        self.cursor.execute(
+        cursor = self._read_cursor()
+        cursor.execute(
             """
-            SELECT user_id, telegram_id, name, end_date, is_unlimited, has_used_trial
+            SELECT user_id, telegram_id, name, end_date, is_unlimited, has_used_trial, end_day
             FROM users
             WHERE telegram_id = ?
             """,
             (telegram_id,),
         )
-        row = self.cursor.fetchone()
+        row = cursor.fetchone()
         if not row:
             return False
         return UserData(
@@ -111,19 +361,22 @@ class Database:
             end_date=row[3],
             is_unlimited=row[4],
             has_used_trial=row[5],
+            end_day=row[6],
         )
 
+    @reads
     def get_user_by_user_id(self, user_id: int) -> Union[UserData, Literal[False]]:
         """Возвращает пользователя по user_id или False, если не найден."""
-        self.cursor.execute(
+        cursor = self._read_cursor()
+        cursor.execute(
             """
-            SELECT user_id, telegram_id, name, end_date, is_unlimited, has_used_trial
+            SELECT user_id, telegram_id, name, end_date, is_unlimited, has_used_trial, end_day
             FROM users
             WHERE user_id = ?
             """,
             (user_id,),
         )
-        row = self.cursor.fetchone()
+        row = cursor.fetchone()
         if not row:
             return False
         return UserData(
@@ -133,12 +386,15 @@ class Database:
             end_date=row[3],
             is_unlimited=row[4],
             has_used_trial=row[5],
+            end_day=row[6],
         )
 
+    @serialized
     def add_user(self, telegram_id: str, name: str) -> None:
         """Добавляет нового пользователя, если он ещё не существует."""
+        cursor = self.conn.cursor()
         if not self.get_user_by_telegram_id(telegram_id):
-            self.cursor.execute(
+            cursor.execute(
                 """
                 INSERT INTO users (telegram_id, name, end_date, is_unlimited, has_used_trial)
                 VALUES (?, ?, NULL, 0, 0)
@@ -147,40 +403,43 @@ class Database:
             )
             self.conn.commit()
 
+    @reads
     def has_active_subscription(self, telegram_id):
         """Проверяем подписку пользователя
         end_date = NULL и is_unlimited = 0 → нет подписки
         end_date = [дата] и is_unlimited = 0 → обычная подписка
         is_unlimited = 1 → подписка безлимитная (дата не имеет значения)"""
-        self.cursor.execute(
-            "SELECT end_date, is_unlimited FROM users WHERE telegram_id = ?",
+        cursor = self._read_cursor()
+        cursor.execute(
+            "SELECT end_day, is_unlimited FROM users WHERE telegram_id = ?",
             (telegram_id,),
         )
-        row = self.cursor.fetchone()
+        row = cursor.fetchone()
         if not row:
             return False
-        end_date, is_unlimited = row
+        end_day, is_unlimited = row
         if is_unlimited:
             return True
-        if end_date:
-            return datetime.strptime(end_date, "%Y-%m-%d") > datetime.now()
+        if end_day is not None:
+            return end_day > date_to_day(date.today())
         return False
 
+    @reads
     def get_users_expired_yesterday(self) -> List[UserData]:
         """Возвращает список пользователей, у которых подписка закончилась вчера,
         is_unlimited != 1 и end_date не NULL.
         """
-        yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        cursor = self._read_cursor()
+        yesterday = date.today() - timedelta(days=1)
 
-        self.cursor.execute(
+        cursor.execute(
             """
-            SELECT user_id, telegram_id, name, end_date, is_unlimited, has_used_trial
+            SELECT user_id, telegram_id, name, end_date, is_unlimited, has_used_trial, end_day
             FROM users
-            WHERE is_unlimited != 1
-            AND end_date IS NOT NULL
-            AND end_date <= ?
+            WHERE end_day <= ?
+            AND is_unlimited != 1
             """,
-            (yesterday,),
+            (date_to_day(yesterday),),
         )
         logger.info(f"yesterday: {yesterday}")
         return [
@@ -191,25 +450,27 @@ class Database:
                 end_date=row[3],
                 is_unlimited=row[4],
                 has_used_trial=row[5],
+                end_day=row[6],
             )
-            for row in self.cursor.fetchall()
+            for row in cursor.fetchall()
         ]
 
+    @reads
     def get_active_users(self) -> List[UserData]:
         """Возвращает список пользователей с is_unlimited = 1 или у кого end_date сегодня или в будущем."""
-        today = datetime.now().strftime("%Y-%m-%d")
+        cursor = self._read_cursor()
 
-        self.cursor.execute(
+        cursor.execute(
             """
-            SELECT user_id, telegram_id, name, end_date, is_unlimited, has_used_trial
+            SELECT user_id, telegram_id, name, end_date, is_unlimited, has_used_trial, end_day
             FROM users
             WHERE is_unlimited = 1
-            OR (end_date IS NOT NULL AND end_date >= ?)
+            OR end_day >= ?
             """,
-            (today,),
+            (date_to_day(date.today()),),
         )
 
-        rows = self.cursor.fetchall()
+        rows = cursor.fetchall()
         return [
             UserData(
                 user_id=row[0],
@@ -218,25 +479,26 @@ class Database:
                 end_date=row[3],
                 is_unlimited=row[4],
                 has_used_trial=row[5],
+                end_day=row[6],
             )
             for row in rows
         ]
 
+    @reads
     def get_users_expiring_in_days(self, days: List[int]) -> List[UserData]:
         """Возвращает список пользователей, у которых подписка заканчивается через указанные дни."""
-        target_dates = [
-            (datetime.now() + timedelta(days=day)).strftime("%Y-%m-%d") for day in days
-        ]
+        cursor = self._read_cursor()
+        today = date_to_day(date.today())
+        target_days = [today + day for day in days]
 
         query = f"""
-            SELECT user_id, telegram_id, name, end_date, is_unlimited, has_used_trial
+            SELECT user_id, telegram_id, name, end_date, is_unlimited, has_used_trial, end_day
             FROM users
-            WHERE is_unlimited != 1
-            AND end_date IS NOT NULL
-            AND end_date IN ({','.join('?' for _ in target_dates)})
+            WHERE end_day IN ({','.join('?' for _ in target_days)})
+            AND is_unlimited != 1
         """
 
-        self.cursor.execute(query, target_dates)
+        cursor.execute(query, target_days)
 
         return [
             UserData(
@@ -246,10 +508,12 @@ class Database:
                 end_date=row[3],
                 is_unlimited=row[4],
                 has_used_trial=row[5],
+                end_day=row[6],
             )
-            for row in self.cursor.fetchall()
+            for row in cursor.fetchall()
         ]
 
+    @serialized
     def add_config(
         self,
         telegram_id: str,
@@ -274,11 +538,12 @@ class Database:
     ) -> int:
         """Добавляет VPN-конфигурацию пользователя по telegram_id."""
 
+        cursor = self.conn.cursor()
         user = self.get_user_by_telegram_id(telegram_id)
         if not user:
             raise ValueError(f"Пользователь с telegram_id {telegram_id} не найден.")
 
-        self.cursor.execute(
+        cursor.execute(
             """
             INSERT INTO configs (
                 user_id, private_key, address, dns,
@@ -312,11 +577,13 @@ class Database:
             ),
         )
         self.conn.commit()
-        return self.cursor.lastrowid  # ID новой конфигурации
+        return inserted_id(cursor)  # ID новой конфигурации
 
+    @reads
     def get_config_by_telegram_id(self, telegram_id: str) -> Optional[Config]:
         """Возвращает полную конфигурацию пользователя по telegram_id."""
-        self.cursor.execute(
+        cursor = self._read_cursor()
+        cursor.execute(
             """
             SELECT c.config_id, c.user_id,
                 c.private_key, c.address, c.dns,
@@ -332,7 +599,7 @@ class Database:
             """,
             (telegram_id,),
         )
-        row = self.cursor.fetchone()
+        row = cursor.fetchone()
         if row:
             return Config(
                 config_id=row[0],
@@ -358,47 +625,99 @@ class Database:
             )
         return None
 
+    def iter_users_with_configs(
+        self, states: Iterable[str] = (USER_STATE_ACTIVE, USER_STATE_EXPIRED)
+    ) -> Iterator[Tuple[str, UserData, Optional[Config]]]:
+        """Пользователи в указанных состояниях вместе с конфигурациями одним
+        запросом: (состояние, пользователь, конфигурация или None).
+
+        active — безлимит или подписка не закончилась, expired — подписка
+        закончилась вчера или раньше. Строки читаются по мере обхода, читающее
+        соединение занято до конца обхода; при нескольких конфигурациях
+        берётся первая, как в get_config_by_telegram_id."""
+        conditions = {
+            USER_STATE_ACTIVE: "(u.is_unlimited = 1 OR u.end_day >= :today)",
+            USER_STATE_EXPIRED: "(u.end_day <= :yesterday AND u.is_unlimited != 1)",
+        }
+        states = set(states)
+        unknown = states - conditions.keys()
+        if unknown:
+            raise ValueError(f"Неизвестные состояния пользователей: {unknown}")
+        if not states:
+            return
+        today = date_to_day(date.today())
+
+        with self.read_connection() as conn:
+            cursor = conn.execute(
+                f"""
+                SELECT
+                    CASE WHEN u.is_unlimited = 1 OR u.end_day >= :today
+                        THEN '{USER_STATE_ACTIVE}' ELSE '{USER_STATE_EXPIRED}' END,
+                    u.user_id, u.telegram_id, u.name, u.end_date,
+                    u.is_unlimited, u.has_used_trial, u.end_day,
+                    {", ".join(f"c.{column}" for column in CONFIG_COLUMNS)}
+                FROM users u
+                LEFT JOIN configs c ON c.user_id = u.user_id
+                WHERE {" OR ".join(conditions[state] for state in sorted(states))}
+                ORDER BY u.user_id, c.config_id
+                """,
+                {"today": today, "yesterday": today - 1},
+            )
+            last_user_id = None
+            for row in cursor:
+                if row[1] == last_user_id:
+                    continue
+                last_user_id = row[1]
+                user = UserData(
+                    user_id=row[1],
+                    telegram_id=row[2],
+                    name=row[3],
+                    end_date=row[4],
+                    is_unlimited=row[5],
+                    has_used_trial=row[6],
+                    end_day=row[7],
+                )
+                config = None
+                if row[8] is not None:
+                    config = Config(**dict(zip(CONFIG_COLUMNS, row[8:])))
+                yield row[0], user, config
+
+    @serialized
     def update_user_end_date(
         self, telegram_id: str, months_to_add: int
     ) -> Union[UserData, bool]:
         """Продлевает подписку пользователя на указанное количество месяцев."""
 
+        cursor = self.conn.cursor()
         user = self.get_user_by_telegram_id(telegram_id)
         if not user:
             raise ValueError(f"Пользователь с telegram_id {telegram_id} не найден.")
 
-        # Получаем текущую дату окончания
-        self.cursor.execute(
-            "SELECT end_date FROM users WHERE user_id = ?", (user.user_id,)
-        )
-        result = self.cursor.fetchone()
-
-        if result and result[0]:
-            current_end_date = datetime.strptime(result[0], "%Y-%m-%d")
-            # Если дата окончания в прошлом — берем сегодняшнюю дату
-            if current_end_date < datetime.now():
-                current_end_date = datetime.now()
-        else:
-            # Если даты нет, начинаем с сегодняшнего дня
-            current_end_date = datetime.now()
+        # Текущая дата окончания; если её нет или она в прошлом —
+        # начинаем с сегодняшнего дня
+        current_end_date = user.end
+        if current_end_date is None or current_end_date < date.today():
+            current_end_date = date.today()
 
         # Прибавляем месяцы
         new_end_date = current_end_date + relativedelta(months=months_to_add)
-        new_end_date_str = new_end_date.strftime("%Y-%m-%d")
 
-        # Обновляем дату окончания
-        self.cursor.execute(
+        # Обновляем дату окончания; end_day пересчитывает триггер
+        cursor.execute(
             "UPDATE users SET end_date = ? WHERE user_id = ?",
-            (new_end_date_str, user.user_id),
+            (new_end_date.strftime("%Y-%m-%d"), user.user_id),
         )
         self.conn.commit()
         return user
 
+    @serialized
     def delete_configs_by_user_id(self, user_id):
         """Удаляет все VPN-конфигурации, связанные с пользователем по его ID."""
-        self.cursor.execute("DELETE FROM configs WHERE user_id = ?", (user_id,))
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM configs WHERE user_id = ?", (user_id,))
         self.conn.commit()
 
+    @serialized
     def add_payment(
         self,
         user_id,
@@ -408,9 +727,10 @@ class Database:
         raw_payload,
         unique_payload,
         status="pending",
-    ):
-        """Создаёт запись о платеже."""
-        self.cursor.execute(
+    ) -> int:
+        """Создаёт запись о платеже и возвращает её ID."""
+        cursor = self.conn.cursor()
+        cursor.execute(
             """
             INSERT INTO payments (
                 user_id, amount, months, provider_payment_id, raw_payload, unique_payload, status
@@ -427,8 +747,9 @@ class Database:
             ),
         )
         self.conn.commit()
-        return self.cursor.lastrowid
+        return inserted_id(cursor)
 
+    @serialized
     def update_payment_status(
         self, raw_payload: str, unique_payload: str, new_status: str
     ) -> Optional[Payment]:
@@ -436,7 +757,8 @@ class Database:
         Обновляет unique_payload и статус платежа по raw_payload.
         Возвращает обновлённый объект Payment, если успешно, иначе None.
         """
-        self.cursor.execute(
+        cursor = self.conn.cursor()
+        cursor.execute(
             """
             UPDATE payments
             SET unique_payload = ?, status = ?
@@ -446,11 +768,11 @@ class Database:
         )
         self.conn.commit()
 
-        if self.cursor.rowcount == 0:
+        if cursor.rowcount == 0:
             return None
 
         # Получаем обновлённый платёж
-        self.cursor.execute(
+        cursor.execute(
             """
             SELECT payment_id, user_id, amount, months, provider_payment_id,
                 payment_time, raw_payload, status, unique_payload
@@ -459,7 +781,7 @@ class Database:
             """,
             (raw_payload,),
         )
-        row = self.cursor.fetchone()
+        row = cursor.fetchone()
         if row:
             return Payment(
                 payment_id=row[0],
@@ -474,57 +796,140 @@ class Database:
             )
         return None
 
+    @reads
     def count_active_users(self) -> int:
-        """Считает количество активных пользователей с учётом ограничений."""
-        today = datetime.now().date()
-        month_ago = today - timedelta(days=30)
+        """Считает количество пользователей с безлимитной или действующей подпиской."""
+        cursor = self._read_cursor()
 
-        self.cursor.execute(
+        cursor.execute(
             """
             SELECT COUNT(*) FROM users
-            WHERE
-                is_unlimited = 1
-                OR (
-                    end_date IS NOT NULL
-                    AND date(end_date) >= ?
-                    AND subscription_start IS NOT NULL
-                    AND date(subscription_start) >= ?
-                )
+            WHERE is_unlimited = 1
+            OR end_day >= ?
             """,
-            (today.strftime("%Y-%m-%d"), month_ago.strftime("%Y-%m-%d")),
+            (date_to_day(date.today()),),
         )
-        return self.cursor.fetchone()[0]
+        return cursor.fetchone()[0]
     
+    @reads
     def is_recently_active_user(self, telegram_id: str) -> bool:
         """Проверяет, является ли пользователь активным или недавно активным (до 30 дней назад)."""
-        self.cursor.execute(
+        cursor = self._read_cursor()
+        cursor.execute(
             """
-            SELECT end_date, is_unlimited
+            SELECT end_day, is_unlimited
             FROM users
             WHERE telegram_id = ?
             """,
             (telegram_id,),
         )
-        row = self.cursor.fetchone()
+        row = cursor.fetchone()
 
         if not row:
             return False  # пользователь не найден
 
-        end_date_str, is_unlimited = row
+        end_day, is_unlimited = row
 
         if is_unlimited:
             return True
 
-        if end_date_str:
-            try:
-                end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date()
-                month_ago = datetime.now().date() - timedelta(days=30)
-                return end_date >= month_ago
-            except ValueError:
-                return False  # некорректная дата
+        if end_day is not None:
+            month_ago = date.today() - timedelta(days=30)
+            return end_day >= date_to_day(month_ago)
 
-        return False
+        return False  # даты нет или она некорректна
+
+    @serialized
+    def record_connections(self, rows: List[Tuple[str, str, int, int]]) -> None:
+        """Сохраняет отметки подключений (username, ip, first_seen, last_seen)
+        одной транзакцией; для известного адреса сдвигается last_seen."""
+        cursor = self.conn.cursor()
+        cursor.executemany(
+            """
+            INSERT INTO connections (username, ip, first_seen, last_seen)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (username, ip) DO UPDATE SET
+                first_seen = MIN(first_seen, excluded.first_seen),
+                last_seen = MAX(last_seen, excluded.last_seen)
+            """,
+            rows,
+        )
+        self.conn.commit()
+
+    @reads
+    def get_recent_connections(
+        self, username: str, limit: int = 5
+    ) -> List[Tuple[str, int]]:
+        """Последние limit адресов клиента: [(ip, last_seen), ...] от новых к старым."""
+        cursor = self._read_cursor()
+        cursor.execute(
+            """
+            SELECT ip, last_seen
+            FROM connections
+            WHERE username = ?
+            ORDER BY last_seen DESC
+            LIMIT ?
+            """,
+            (username, limit),
+        )
+        return cursor.fetchall()
 
+    @serialized
+    def prune_connections(self, older_than: int) -> int:
+        """Удаляет адреса, не встречавшиеся с older_than (unix time)."""
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM connections WHERE last_seen < ?", (older_than,))
+        self.conn.commit()
+        return cursor.rowcount
+
+    def backup_to(self, path: str) -> None:
+        """Записывает согласованный снимок базы в path, включая ещё не
+        перенесённые из WAL страницы; запись при этом не блокируется."""
+        target = sqlite3.connect(path)
+        try:
+            with self.read_connection() as conn:
+                conn.backup(target)
+        finally:
+            target.close()
+
+    @serialized
     def close(self):
-        """Закрывает соединение с базой данных."""
+        """Закрывает соединения с базой данных."""
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
         self.conn.close()
+
+
+class AsyncDatabase:
+    """Асинхронный доступ к Database для обработчиков.
+
+    Запись выполняется в отдельном потоке БД, чтения — в пуле потоков по
+    числу читающих соединений, поэтому ни то ни другое не блокирует event
+    loop и чтения не ждут идущую запись. Любой публичный метод Database
+    доступен как корутина с теми же аргументами:
+    await async_user_db.get_user_by_telegram_id(telegram_id)"""
+
+    def __init__(self, db: Database):
+        self.db = db
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="awg-db")
+        self._read_executor = ThreadPoolExecutor(
+            max_workers=max(db.read_connections, 1), thread_name_prefix="awg-db-read"
+        )
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        executor = self._read_executor if getattr(func, "reads", False) else self._executor
+        return await loop.run_in_executor(
+            executor, functools.partial(func, *args, **kwargs)
+        )
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        method = getattr(self.db, name)
+        if name.startswith("_") or not callable(method):
+            raise AttributeError(name)
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+
+        return call
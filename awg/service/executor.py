@@ -0,0 +1,60 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+BLOCKING_WORKERS = 8
+DEFAULT_TIMEOUT = 30  # секунд
+# Сколько одновременных вызовов каждого вида допускается; остальные ждут
+# в очереди, не занимая потоки пула.
+CONCURRENCY_LIMITS = {
+    "docker": 4,  # docker exec в контейнер amnezia-awg
+    "ssh": 4,  # опрос и деплой удалённых нод
+    "files": 2,  # бэкапы и локальные файлы состояния
+    "stats": 1,  # vnstat/vnstati: тяжёлые и редкие отчёты
+}
+
+_executor = ThreadPoolExecutor(
+    max_workers=BLOCKING_WORKERS, thread_name_prefix="awg-blocking"
+)
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+def _semaphore(kind: str) -> asyncio.Semaphore:
+    if kind not in CONCURRENCY_LIMITS:
+        raise ValueError(f"Неизвестный вид блокирующего вызова: {kind}")
+    if kind not in _semaphores:
+        _semaphores[kind] = asyncio.Semaphore(CONCURRENCY_LIMITS[kind])
+    return _semaphores[kind]
+
+
+async def run_blocking(
+    func: Callable[..., T],
+    *args,
+    timeout: float = DEFAULT_TIMEOUT,
+    kind: str = "docker",
+    **kwargs,
+) -> T:
+    """Выполняет блокирующую функцию в пуле потоков, не останавливая event loop.
+
+    Ожидание в очереди не входит в timeout. По истечении timeout выбрасывается
+    asyncio.TimeoutError; сам поток дорабатывает вызов до конца, поэтому
+    subprocess-вызовы внутри должны иметь собственный timeout."""
+    loop = asyncio.get_running_loop()
+    async with _semaphore(kind):
+        future = loop.run_in_executor(
+            _executor, functools.partial(func, *args, **kwargs)
+        )
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            logger.error(
+                f"{getattr(func, '__name__', func)} не завершился за {timeout} с."
+            )
+            raise
+
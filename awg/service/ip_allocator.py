@@ -0,0 +1,115 @@
+import ipaddress
+import threading
+from typing import Iterable, List, Optional, Set
+
+DEFAULT_CLIENT_SUBNETS = "10.8.1.0/24"
+
+
+class SubnetBitmap:
+    """Занятость адресов одной подсети в виде битовой маски (бит = смещение)."""
+
+    def __init__(self, network: ipaddress.IPv4Network):
+        self.network = network
+        self.size = network.num_addresses
+        self.bits = 0
+        # Адрес сети и broadcast клиентам не выдаются
+        for offset in (0, self.size - 1):
+            self.mark(offset)
+
+    def offset_of(self, address: ipaddress.IPv4Address) -> Optional[int]:
+        if address not in self.network:
+            return None
+        return int(address) - int(self.network.network_address)
+
+    def mark(self, offset: int) -> None:
+        self.bits |= 1 << offset
+
+    def clear(self, offset: int) -> None:
+        self.bits &= ~(1 << offset)
+
+    def first_free(self) -> Optional[int]:
+        lowest_zero = ~self.bits & (self.bits + 1)
+        offset = lowest_zero.bit_length() - 1
+        return offset if offset < self.size else None
+
+
+class AddressAllocator:
+    """Выдаёт клиентам адреса из одной или нескольких подсетей.
+
+    Подсети перебираются по порядку: следующая используется, когда заполнена
+    предыдущая (адрес интерфейса сервера должен покрывать их все). Выданный,
+    но ещё не записанный в wg0.conf адрес остаётся зарезервированным до
+    commit()/release(), в том числе после перестроения по новому конфигу."""
+
+    def __init__(self, subnets: Iterable[str] = (DEFAULT_CLIENT_SUBNETS,)):
+        self.subnets = [ipaddress.IPv4Network(subnet.strip()) for subnet in subnets]
+        self._lock = threading.Lock()
+        self._pending: Set[ipaddress.IPv4Address] = set()
+        self._bitmaps: List[SubnetBitmap] = []
+        self.rebuild([])
+
+    @classmethod
+    def from_setting(cls, value: Optional[str]) -> "AddressAllocator":
+        """Создаёт аллокатор по строке вида '10.8.1.0/24, 10.8.2.0/24'."""
+        subnets = [s for s in (value or DEFAULT_CLIENT_SUBNETS).split(",") if s.strip()]
+        return cls(subnets)
+
+    def rebuild(self, used_addresses: Iterable[str], server_address: str = "") -> None:
+        """Заново строит маски по адресам из AllowedIPs всех пиров.
+
+        server_address — значение Address из [Interface]: IPv4-адрес сервера
+        занимается только в той подсети, которая его содержит."""
+        with self._lock:
+            self._bitmaps = [SubnetBitmap(network) for network in self.subnets]
+            for interface in server_address.split(","):
+                try:
+                    server_ip = ipaddress.ip_interface(interface.strip()).ip
+                except ValueError:
+                    continue
+                if isinstance(server_ip, ipaddress.IPv4Address):
+                    self._set(server_ip, True)
+            for address in used_addresses:
+                try:
+                    self._set(ipaddress.IPv4Address(address), True)
+                except ValueError:
+                    continue  # IPv6 и прочие адреса вне наших подсетей
+            for pending in self._pending:
+                self._set(pending, True)
+
+    def _set(self, address: ipaddress.IPv4Address, used: bool) -> bool:
+        for bitmap in self._bitmaps:
+            offset = bitmap.offset_of(address)
+            if offset is None:
+                continue
+            if used:
+                bitmap.mark(offset)
+            else:
+                bitmap.clear(offset)
+            return True
+        return False
+
+    def allocate(self) -> str:
+        """Резервирует и возвращает первый свободный адрес."""
+        with self._lock:
+            for bitmap in self._bitmaps:
+                offset = bitmap.first_free()
+                if offset is None:
+                    continue
+                bitmap.mark(offset)
+                address = bitmap.network.network_address + offset
+                self._pending.add(address)
+                return str(address)
+        subnets = ", ".join(str(network) for network in self.subnets)
+        raise ValueError(f"Свободных адресов в подсетях {subnets} не осталось.")
+
+    def commit(self, address: str) -> None:
+        """Адрес записан в wg0.conf — резерв больше не нужен."""
+        with self._lock:
+            self._pending.discard(ipaddress.IPv4Address(address))
+
+    def release(self, address: str) -> None:
+        """Освобождает адрес (удалённый пир или неудачное создание)."""
+        ip = ipaddress.IPv4Address(address)
+        with self._lock:
+            self._pending.discard(ip)
+            self._set(ip, False)
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+IP_API_BATCH_LIMIT = 100  # ограничение ip-api на один batch-запрос
+IP_API_TIMEOUT = 10  # секунд на запрос
+
+
+class IpApiClient:
+    """Клиент ip-api.com с общей сессией aiohttp.
+
+    Соединения переиспользуются между запросами, ISP для нескольких адресов
+    запрашиваются batch-запросами, а одновременные запросы одного адреса
+    объединяются в один. base_url можно направить на локальную заглушку."""
+
+    def __init__(self, base_url: str = "http://ip-api.com"):
+        self.base_url = base_url.rstrip("/")
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=IP_API_TIMEOUT)
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def lookup(self, ip: str) -> dict:
+        """Полная информация об адресе; {} при ошибке."""
+        try:
+            async with self.session.get(f"{self.base_url}/json/{ip}") as resp:
+                return await resp.json() if resp.status == 200 else {}
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"ip-api недоступен для {ip}: {e}")
+            return {}
+
+    async def get_isp_many(self, ips: Iterable[str]) -> Dict[str, Optional[str]]:
+        """ISP для каждого адреса; None — ip-api не ответил."""
+        waiting: Dict[str, asyncio.Future] = {}
+        to_fetch: List[str] = []
+        loop = asyncio.get_running_loop()
+        for ip in dict.fromkeys(ips):
+            future = self._inflight.get(ip)
+            if future is None:
+                future = loop.create_future()
+                self._inflight[ip] = future
+                to_fetch.append(ip)
+            waiting[ip] = future
+
+        try:
+            for start in range(0, len(to_fetch), IP_API_BATCH_LIMIT):
+                batch = to_fetch[start : start + IP_API_BATCH_LIMIT]
+                results = await self._fetch_batch(batch)
+                for ip in batch:
+                    future = self._inflight.pop(ip)
+                    if not future.done():
+                        future.set_result(results.get(ip))
+        finally:
+            # При отмене ожидающие тех же адресов не должны зависнуть
+            for ip in to_fetch:
+                future = self._inflight.pop(ip, None)
+                if future is not None and not future.done():
+                    future.set_result(None)
+
+        # shield: отмена одного вызывающего не должна отменять общий future
+        return {ip: await asyncio.shield(future) for ip, future in waiting.items()}
+
+    async def _fetch_batch(self, batch: List[str]) -> Dict[str, Optional[str]]:
+        try:
+            async with self.session.post(
+                f"{self.base_url}/batch",
+                params={"fields": "status,query,isp"},
+                json=batch,
+            ) as resp:
+                if resp.status != 200:
+                    logger.warning(f"ip-api batch вернул {resp.status}")
+                    return {}
+                data = await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"ip-api недоступен: {e}")
+            return {}
+        return {
+            item["query"]: item.get("isp") or "Unknown ISP"
+            for item in data
+            if item.get("status") == "success"
+        }
@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ISP_CACHE_MAX_ENTRIES = 10000  # записей в памяти
+NEGATIVE_TTL = 300  # секунд для адресов, по которым ip-api не ответил
+LOCAL_TTL = 30 * 24 * 3600  # для частных и некорректных адресов
+
+
+class IspCache:
+    """Ограниченный LRU-кэш ISP с TTL и хранилищем в SQLite.
+
+    В памяти держится не больше max_entries записей, остальные читаются с
+    диска по первичному ключу при обращении, поэтому при запуске ничего не
+    загружается целиком. Отрицательные ответы (частные, некорректные
+    адреса, ошибки ip-api) кэшируются только в памяти."""
+
+    def __init__(self, path: str, ttl: int, max_entries: int = ISP_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # ip -> (isp, expires_at)
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._dirty: Dict[str, Tuple[str, int]] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS isp (
+                    ip TEXT PRIMARY KEY,
+                    isp TEXT NOT NULL,
+                    fetched_at INTEGER NOT NULL
+                ) WITHOUT ROWID
+                """
+            )
+        return self._conn
+
+    def _remember(self, ip: str, isp: str, expires_at: float) -> None:
+        self._entries[ip] = (isp, expires_at)
+        self._entries.move_to_end(ip)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, ip: str) -> Optional[str]:
+        now = time.time()
+        entry = self._entries.get(ip)
+        if entry is not None:
+            if entry[1] > now:
+                self._entries.move_to_end(ip)
+                self.hits += 1
+                return entry[0]
+            del self._entries[ip]
+
+        row = self.conn.execute(
+            "SELECT isp, fetched_at FROM isp WHERE ip = ?", (ip,)
+        ).fetchone()
+        if row is not None and row[1] + self.ttl > now:
+            self._remember(ip, row[0], row[1] + self.ttl)
+            self.hits += 1
+            return row[0]
+
+        self.misses += 1
+        return None
+
+    def put(self, ip: str, isp: str) -> None:
+        fetched_at = int(time.time())
+        self._remember(ip, isp, fetched_at + self.ttl)
+        self._dirty[ip] = (isp, fetched_at)
+
+    def put_negative(self, ip: str, label: str, ttl: int = NEGATIVE_TTL) -> None:
+        self._remember(ip, label, time.time() + ttl)
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self._dirty)
+
+    def flush(self) -> int:
+        """Записывает новые ответы на диск и удаляет устаревшие записи."""
+        dirty, self._dirty = self._dirty, {}
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO isp (ip, isp, fetched_at) VALUES (?, ?, ?)",
+                [(ip, isp, fetched_at) for ip, (isp, fetched_at) in dirty.items()],
+            )
+            self.conn.execute(
+                "DELETE FROM isp WHERE fetched_at < ?", (int(time.time()) - self.ttl,)
+            )
+        logger.info(
+            f"Кэш ISP записан: {len(dirty)} новых, в памяти {len(self._entries)}, "
+            f"попаданий {self.hits}, промахов {self.misses}."
+        )
+        return len(dirty)
+
+    def import_json(self, json_path: str) -> None:
+        """Однократно переносит старый files/isp_cache.json в SQLite."""
+        if not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, "r") as f:
+                data = json.load(f)
+            rows: Iterable = [
+                (ip, entry["isp"], int(entry["timestamp"]))
+                for ip, entry in data.items()
+            ]
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO isp (ip, isp, fetched_at) VALUES (?, ?, ?)",
+                    rows,
+                )
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Не удалось перенести {json_path}: {e}")
+            return
+        os.replace(json_path, f"{json_path}.imported")
+        logger.info(f"Кэш ISP перенесён из {json_path}: {len(data)} записей.")
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
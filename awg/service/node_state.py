@@ -0,0 +1,105 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from service.base_model import ConfigGeneration, NodeState
+
+logger = logging.getLogger(__name__)
+
+NODE_STATE_FILE = "files/node_state.json"
+
+
+class NodeStateStore:
+    """Локальное хранилище поколений конфигурации и последнего развёрнутого
+    состояния удалённых нод.
+
+    Каждое новое содержимое локальных файлов получает следующий номер
+    поколения; нода, уже получившая текущее поколение, при деплое
+    пропускается без обращения к ней."""
+
+    def __init__(self, path: str = NODE_STATE_FILE):
+        self.path = path
+        self._states: Optional[Dict[str, NodeState]] = None
+        self._generations: Dict[str, ConfigGeneration] = {}
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, NodeState]:
+        if self._states is None:
+            self._states = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, "r") as f:
+                        raw = json.load(f)
+                    self._states = {
+                        host: NodeState(**state)
+                        for host, state in raw.get("nodes", {}).items()
+                    }
+                    self._generations = {
+                        source: ConfigGeneration(**generation)
+                        for source, generation in raw.get("generations", {}).items()
+                    }
+                except (json.JSONDecodeError, ValueError) as e:
+                    logger.error(f"Повреждён файл состояния нод {self.path}: {e}")
+        return self._states
+
+    def current_generation(self, source: str, fingerprint: str) -> ConfigGeneration:
+        """Поколение для текущего содержимого source; при изменении
+        содержимого номер увеличивается."""
+        with self._lock:
+            current = self._lookup(source, fingerprint)
+            if current is not self._generations.get(source):
+                self._generations[source] = current
+                self._save()
+            return current
+
+    def peek_generation(self, source: str, fingerprint: str) -> ConfigGeneration:
+        """То же, что current_generation, но без записи: для изменённого
+        содержимого возвращается номер, который оно получит при деплое."""
+        with self._lock:
+            return self._lookup(source, fingerprint)
+
+    def _lookup(self, source: str, fingerprint: str) -> ConfigGeneration:
+        self._load()
+        current = self._generations.get(source)
+        if current is not None and current.fingerprint == fingerprint:
+            return current
+        return ConfigGeneration(
+            source=source,
+            generation=current.generation + 1 if current else 1,
+            fingerprint=fingerprint,
+            created_at=datetime.now(timezone.utc),
+        )
+
+    def get(self, host: str) -> Optional[NodeState]:
+        with self._lock:
+            return self._load().get(host)
+
+    def put(self, state: NodeState) -> None:
+        with self._lock:
+            self._load()[state.host] = state
+            self._save()
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "generations": {
+                        source: generation.model_dump(mode="json")
+                        for source, generation in self._generations.items()
+                    },
+                    "nodes": {
+                        host: state.model_dump(mode="json")
+                        for host, state in (self._states or {}).items()
+                    },
+                },
+                f,
+            )
+        os.replace(tmp_path, self.path)
+
+
+node_states = NodeStateStore()
@@ -3,7 +3,7 @@ import time
 from typing import List
 
 from keyboard.menu import get_user_profile_menu
-from service.db_instance import user_db
+from service.db_instance import async_user_db
 from service.base_model import UserData
 from settings import ADMINS, BOT
 
@@ -16,7 +16,7 @@ async def daily_check_end_date_and_notify():
 
     try:
         days_before_end = [10, 5, 2]
-        users = user_db.get_users_expiring_in_days(days_before_end)
+        users = await async_user_db.get_users_expiring_in_days(days_before_end)
         await notify_users(users)
     except Exception as e:
         logger.error(f"❌ Ошибка в daily_check_end_date_and_notify: {e}")
@@ -1,71 +1,87 @@
 
-from datetime import datetime
-import json
-import os
-from typing import Dict
+from typing import Dict, Iterator, NamedTuple, Optional
 
-from service.base_model import ActiveClient, PeerData
+from service.base_model import ActiveClient
+from service.connection_history import connection_history
 
 
 def save_client_endpoint(username, endpoint):
-    os.makedirs("files/connections", exist_ok=True)
-    file_path = os.path.join("files", "connections", f"{username}_ip.json")
-    timestamp = datetime.now().strftime("%d.%m.%Y %H:%M")
-    ip_address = endpoint.split(":")[0]
+    """Отмечает адрес подключения клиента; запись на диск — пакетами."""
+    connection_history.record(username, endpoint)
 
-    if os.path.exists(file_path):
-        with open(file_path, "r") as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                data = {}
-    else:
-        data = {}
 
-    data[ip_address] = timestamp
+class PeerStat(NamedTuple):
+    """Строка пира из `wg show ... dump`: точные счётчики и время в epoch."""
 
-    with open(file_path, "w") as f:
-        json.dump(data, f)
+    interface: str
+    public_key: str
+    endpoint: Optional[str]
+    allowed_ips: str
+    latest_handshake: int  # unix time, 0 — рукопожатий не было
+    rx_bytes: int
+    tx_bytes: int
 
 
-def parse_wg_show_output(
-    wg_output: str, client_key_map: Dict[str, str]
-) -> Dict[str, ActiveClient]:
-    active_clients: Dict[str, ActiveClient] = {}
-    peer = PeerData()
+def parse_wg_dump(output: str, interface: Optional[str] = None) -> Iterator[PeerStat]:
+    """Разбирает вывод `wg show all dump` (interface=None) или `wg show <iface> dump`.
 
-    def save_if_active(peer: PeerData):
-        if not peer.public_key or not peer.is_active():
-            return
-        username = client_key_map.get(peer.public_key)
-        if username:
-            client = ActiveClient(
-                last_time=peer.latest_handshake or "Нет данных",
-                transfer=peer.transfer or "Нет данных",
-                endpoint=peer.endpoint or "Нет данных",
+    Поля разделены табуляцией. Первая строка каждого интерфейса описывает
+    сам интерфейс и пропускается, остальные — пиры:
+    [iface] public-key preshared-key endpoint allowed-ips latest-handshake
+    transfer-rx transfer-tx persistent-keepalive
+    """
+    current_interface = interface
+    header_seen = False
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        fields = line.split("\t")
+        if interface is None:
+            if fields[0] != current_interface:
+                current_interface = fields[0]
+                continue
+            fields = fields[1:]
+        elif not header_seen:
+            header_seen = True
+            continue
+        if len(fields) < 7:
+            continue
+        try:
+            yield PeerStat(
+                interface=current_interface or "",
+                public_key=fields[0],
+                endpoint=None if fields[2] == "(none)" else fields[2],
+                allowed_ips="" if fields[3] == "(none)" else fields[3],
+                latest_handshake=int(fields[4]),
+                rx_bytes=int(fields[5]),
+                tx_bytes=int(fields[6]),
             )
-            save_client_endpoint(username, client.endpoint)
-            active_clients[username] = client
+        except ValueError:
+            continue
 
-    for line in wg_output.splitlines():
-        line = line.strip()
-        if not line:
-            save_if_active(peer)
-            peer = PeerData()
+
+def active_client_from_stat(stat: PeerStat) -> ActiveClient:
+    return ActiveClient(
+        endpoint=stat.endpoint or "Нет данных",
+        latest_handshake=stat.latest_handshake,
+        rx_bytes=stat.rx_bytes,
+        tx_bytes=stat.tx_bytes,
+    )
+
+
+def parse_wg_dump_output(
+    wg_dump: str, client_key_map: Dict[str, str]
+) -> Dict[str, ActiveClient]:
+    """Активные (с рукопожатием) клиенты из `wg show all dump`, по имени клиента."""
+    active_clients: Dict[str, ActiveClient] = {}
+    for stat in parse_wg_dump(wg_dump):
+        if not stat.latest_handshake:
             continue
-        key_value = line.split(":", 1)
-        if len(key_value) != 2:
+        username = client_key_map.get(stat.public_key)
+        if not username:
             continue
-        key, value = key_value[0].strip(), key_value[1].strip()
-        match key:
-            case "peer":
-                peer.public_key = value
-            case "endpoint":
-                peer.endpoint = value
-            case "latest handshake":
-                peer.latest_handshake = value
-            case "transfer":
-                peer.transfer = value
-
-    save_if_active(peer)
-    return active_clients
\ No newline at end of file
+        client = active_client_from_stat(stat)
+        if stat.endpoint:
+            save_client_endpoint(username, stat.endpoint)
+        active_clients[username] = client
+    return active_clients
@@ -0,0 +1,82 @@
+import ipaddress
+from typing import Dict, List, Optional
+
+from service.base_model import WgPeer
+from service.wg_config import WgConfig
+
+
+def parse_wg_peers(config_content: str, client_map: Dict[str, str]) -> List[WgPeer]:
+    """Разбирает секции [Peer] из wg0.conf. Имя берётся из clientsTable,
+    а при его отсутствии — из комментария '# name' внутри блока."""
+    return [
+        WgPeer(
+            name=client_map.get(block.public_key, block.name or "Unknown"),
+            public_key=block.public_key,
+            preshared_key=block.preshared_key,
+            allowed_ips=block.allowed_ips,
+        )
+        for block in WgConfig.parse(config_content).peers
+    ]
+
+
+def split_allowed_ips(allowed_ips: str) -> List[str]:
+    """Возвращает адреса из AllowedIPs без префикса: '10.8.1.2/32' -> '10.8.1.2'."""
+    addresses = []
+    for item in allowed_ips.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            addresses.append(str(ipaddress.ip_interface(item).ip))
+        except ValueError:
+            continue
+    return addresses
+
+
+class PeerIndex:
+    """Разобранный wg0.conf в памяти с индексами по публичному ключу, имени и IP.
+
+    fingerprint — отпечаток содержимого wg0.conf и clientsTable, по которому
+    определяется, что файлы на сервере изменились и индекс нужно перестроить.
+    """
+
+    def __init__(self, peers: List[WgPeer], fingerprint: str = ""):
+        self.peers = peers
+        self.fingerprint = fingerprint
+        self.by_public_key: Dict[str, WgPeer] = {}
+        self.by_name: Dict[str, WgPeer] = {}
+        self.by_ip: Dict[str, WgPeer] = {}
+        for peer in peers:
+            if peer.public_key:
+                self.by_public_key[peer.public_key] = peer
+            # При совпадении имён приоритет у первого блока, как и раньше
+            self.by_name.setdefault(peer.name, peer)
+            for address in split_allowed_ips(peer.allowed_ips):
+                self.by_ip[address] = peer
+
+    @classmethod
+    def from_config(
+        cls, config_content: str, client_map: Dict[str, str], fingerprint: str = ""
+    ) -> "PeerIndex":
+        return cls(parse_wg_peers(config_content, client_map), fingerprint)
+
+    def __len__(self) -> int:
+        return len(self.peers)
+
+    def get_by_name(self, name: str) -> Optional[WgPeer]:
+        return self.by_name.get(name)
+
+    def get_by_public_key(self, public_key: str) -> Optional[WgPeer]:
+        return self.by_public_key.get(public_key)
+
+    def get_by_ip(self, ip: str) -> Optional[WgPeer]:
+        addresses = split_allowed_ips(ip)
+        return self.by_ip.get(addresses[0]) if addresses else None
+
+    def client_key_map(self) -> Dict[str, str]:
+        """public_key -> имя клиента."""
+        return {key: peer.name for key, peer in self.by_public_key.items()}
+
+    def as_client_list(self) -> List[list]:
+        """Формат get_client_list(): [имя, публичный ключ, AllowedIPs]."""
+        return [[peer.name, peer.public_key, peer.allowed_ips] for peer in self.peers]
@@ -0,0 +1,95 @@
+import re
+from datetime import datetime
+from typing import List
+
+from service.base_model import ProvisionedPeer
+from service.ip_allocator import AddressAllocator
+from service.wg_config import WgConfig
+from service.wg_keys import (
+    generate_preshared_key,
+    generate_private_key,
+    public_key_from_private,
+)
+
+CLIENT_NAME_RE = re.compile(r"^[a-zA-Z0-9_-]+$")
+CLIENT_DNS = "1.1.1.1, 1.0.0.1"
+AWG_INTERFACE_PARAMS = ["Jc", "Jmin", "Jmax", "S1", "S2", "H1", "H2", "H3", "H4"]
+
+
+class PeerProvisioner:
+    """Создаёт пиров в памяти: ключи, адрес, секция [Peer] в wg0.conf,
+    запись в clientsTable и клиентский конфиг. Запись на сервер и применение
+    изменений выполняет вызывающий код одним обращением к контейнеру."""
+
+    def __init__(
+        self,
+        config: WgConfig,
+        clients_table: List[dict],
+        endpoint: str,
+        allocator: AddressAllocator,
+    ):
+        self.config = config
+        self.clients_table = clients_table
+        self.endpoint = endpoint
+        self.allocator = allocator
+
+        server_private_key = config.interface_value("PrivateKey")
+        if not server_private_key:
+            raise ValueError("В [Interface] wg0.conf не найден PrivateKey.")
+        self.server_public_key = public_key_from_private(server_private_key)
+        self.listen_port = config.interface_value("ListenPort")
+        self.awg_params = [
+            f"{key} = {value}"
+            for key in AWG_INTERFACE_PARAMS
+            if (value := config.interface_value(key)) is not None
+        ]
+
+    def provision(self, name: str) -> ProvisionedPeer:
+        if not CLIENT_NAME_RE.match(name):
+            raise ValueError(
+                f"Некорректное имя клиента {name!r}: допустимы буквы, цифры, '_' и '-'."
+            )
+
+        private_key = generate_private_key()
+        public_key = public_key_from_private(private_key)
+        preshared_key = generate_preshared_key()
+        address = f"{self.allocator.allocate()}/32"
+
+        self.config.add_peer(name, public_key, preshared_key, address)
+        self.clients_table.append(
+            {
+                "clientId": public_key,
+                "userData": {
+                    "clientName": name,
+                    "creationDate": datetime.now().ctime(),
+                },
+            }
+        )
+
+        return ProvisionedPeer(
+            name=name,
+            address=address,
+            public_key=public_key,
+            preshared_key=preshared_key,
+            client_config=self.render_client_config(
+                address, private_key, preshared_key
+            ),
+        )
+
+    def render_client_config(
+        self, address: str, private_key: str, preshared_key: str
+    ) -> str:
+        lines = [
+            "[Interface]",
+            f"Address = {address}",
+            f"DNS = {CLIENT_DNS}",
+            f"PrivateKey = {private_key}",
+            *self.awg_params,
+            "[Peer]",
+            f"PublicKey = {self.server_public_key}",
+            f"PresharedKey = {preshared_key}",
+            "AllowedIPs = 0.0.0.0/0",
+            f"Endpoint = {self.endpoint}:{self.listen_port}",
+            "PersistentKeepalive = 25",
+        ]
+        return "\n".join(lines) + "\n"
@@ -9,10 +9,14 @@ from service.system_stats import (
     get_vnstat_hourly,
     get_vnstati_image_to_buffer,
 )
+from service.db_instance import user_db
+from service.executor import run_blocking
 from settings import ADMINS, BOT, DB_FILE
 
 logger = logging.getLogger(__name__)
 
+BACKUP_TIMEOUT = 120  # секунд на снимок базы и сборку архива
+
 
 def create_db_backup(original_path: str, backup_dir: str = "backups") -> bytes:
     """Создает ZIP-резервную копию базы данных и других важных файлов, возвращает путь к ZIP-файлу (который будет удалён после использования)."""
@@ -21,12 +25,19 @@ def create_db_backup(original_path: str, backup_dir: str = "backups") -> bytes:
     backup_zip_path = os.path.join(backup_dir, f"full_backup_{timestamp}.zip")
 
     with zipfile.ZipFile(backup_zip_path, "w") as zipf:
-        # Добавить базу данных
+        # Добавить базу данных: снимок через пул читателей, а не сам файл,
+        # иначе в архив не попадут изменения, ещё лежащие в WAL
         if os.path.exists(original_path):
-            zipf.write(original_path, os.path.relpath(original_path, os.getcwd()))
+            snapshot_path = os.path.join(backup_dir, f"database_{timestamp}.db")
+            try:
+                user_db.backup_to(snapshot_path)
+                zipf.write(snapshot_path, os.path.relpath(original_path, os.getcwd()))
+            finally:
+                if os.path.exists(snapshot_path):
+                    os.remove(snapshot_path)
 
         # Добавить отдельные скрипты
-        for file in ["awg-decode.py", "newclient.sh", "removeclient.sh"]:
+        for file in ["awg-decode.py"]:
             if os.path.exists(file):
                 zipf.write(file, os.path.relpath(file, os.getcwd()))
 
@@ -54,7 +65,9 @@ def create_db_backup(original_path: str, backup_dir: str = "backups") -> bytes:
 
 async def send_backup():
     try:
-        backup_bytes = create_db_backup(DB_FILE)
+        backup_bytes = await run_blocking(
+            create_db_backup, DB_FILE, timeout=BACKUP_TIMEOUT, kind="files"
+        )
 
         input_file = BufferedInputFile(file=backup_bytes, filename="backup.zip")
 
@@ -71,7 +84,7 @@ async def send_backup():
 
 async def send_peak_usage():
     """Отчет по нагрузке на сеть по серверам"""
-    image_buf = get_vnstati_image_to_buffer()
+    image_buf = await run_blocking(get_vnstati_image_to_buffer, kind="stats")
     if not image_buf:
         for admin_id in ADMINS:
             await BOT.answer(
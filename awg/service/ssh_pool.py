@@ -0,0 +1,128 @@
+import logging
+import os
+import socket
+import threading
+from typing import Dict, Optional, Tuple
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+SSH_CONNECT_TIMEOUT = 10  # секунд на TCP-подключение и аутентификацию
+SSH_COMMAND_TIMEOUT = 60  # секунд без данных от удалённой команды
+SSH_KEEPALIVE_INTERVAL = 30  # секунд между keepalive-пакетами
+
+# Ошибки, после которых соединение считается потерянным
+CONNECTION_ERRORS = (paramiko.SSHException, EOFError, socket.error)
+
+
+class SSHPool:
+    """Постоянные SSH-соединения к удалённым нодам, по одному на ssh_host.
+
+    Соединение открывается при первом обращении, поддерживается keepalive и
+    проверяется перед выдачей; оборванное соединение переоткрывается.
+    Команды выполняются в отдельных каналах одного транспорта, поэтому
+    параллельные вызовы к одной ноде не требуют новых рукопожатий."""
+
+    def __init__(self):
+        self._clients: Dict[str, paramiko.SSHClient] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def _host_lock(self, ssh_host: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(ssh_host, threading.Lock())
+
+    @staticmethod
+    def _is_alive(client: paramiko.SSHClient) -> bool:
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except CONNECTION_ERRORS:
+            return False
+        return True
+
+    @staticmethod
+    def _connect(server: dict) -> paramiko.SSHClient:
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(
+            hostname=server["ssh_host"],
+            port=server.get("ssh_port", 22),
+            username=server["ssh_user"],
+            key_filename=os.path.expanduser(server["ssh_key_path"]),
+            timeout=SSH_CONNECT_TIMEOUT,
+            banner_timeout=SSH_CONNECT_TIMEOUT,
+            auth_timeout=SSH_CONNECT_TIMEOUT,
+        )
+        transport = client.get_transport()
+        if transport is not None:
+            transport.set_keepalive(SSH_KEEPALIVE_INTERVAL)
+        logger.info(f"🔌 SSH-соединение с {server['ssh_host']} установлено.")
+        return client
+
+    def get(self, server: dict) -> paramiko.SSHClient:
+        """Возвращает живое соединение с нодой, при необходимости переподключаясь."""
+        ssh_host = server["ssh_host"]
+        with self._host_lock(ssh_host):
+            client = self._clients.get(ssh_host)
+            if client is not None and self._is_alive(client):
+                return client
+            if client is not None:
+                logger.warning(f"SSH-соединение с {ssh_host} потеряно, переподключаюсь.")
+                client.close()
+            client = self._connect(server)
+            self._clients[ssh_host] = client
+            return client
+
+    def discard(self, ssh_host: str) -> None:
+        with self._host_lock(ssh_host):
+            client = self._clients.pop(ssh_host, None)
+        if client is not None:
+            client.close()
+
+    def run(
+        self,
+        server: dict,
+        cmd: str,
+        timeout: float = SSH_COMMAND_TIMEOUT,
+        input: Optional[bytes] = None,
+    ) -> Tuple[int, str, str]:
+        """Выполняет команду на ноде и ждёт её завершения.
+
+        input, если задан, передаётся команде в stdin. При обрыве соединения команда повторяется один раз на новом
+        соединении. Возвращает (код выхода, stdout, stderr)."""
+        try:
+            return self._exec(self.get(server), cmd, timeout, input)
+        except socket.timeout:
+            raise  # команда выполняется слишком долго, соединение живо
+        except CONNECTION_ERRORS as e:
+            logger.warning(f"Ошибка SSH на {server['ssh_host']}: {e}, повторяю.")
+            self.discard(server["ssh_host"])
+        return self._exec(self.get(server), cmd, timeout, input)
+
+    @staticmethod
+    def _exec(
+        client: paramiko.SSHClient,
+        cmd: str,
+        timeout: float,
+        input: Optional[bytes] = None,
+    ) -> Tuple[int, str, str]:
+        stdin, stdout, stderr = client.exec_command(cmd, timeout=timeout)
+        if input is not None:
+            stdin.write(input)
+            stdin.channel.shutdown_write()
+        output = stdout.read().decode()
+        errors = stderr.read().decode()
+        return stdout.channel.recv_exit_status(), output, errors
+
+    def close_all(self) -> None:
+        with self._guard:
+            hosts = list(self._clients)
+        for ssh_host in hosts:
+            self.discard(ssh_host)
+
+
+ssh_pool = SSHPool()
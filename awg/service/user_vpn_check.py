@@ -1,35 +1,34 @@
-import json
 import logging
-import os
-import subprocess
+import db
 from service.amnezia_server import deploy_to_all_servers
+from service.executor import run_blocking
 from service.db_instance import user_db
-from settings import WG_CONFIG_FILE, DOCKER_CONTAINER
+from service.db_user import USER_STATE_ACTIVE, USER_STATE_EXPIRED
 
 logger = logging.getLogger(__name__)
 
+UPDATE_STATE_TIMEOUT = 300  # ротация ключей и деплой на все сервера
+
 
 def get_all_users_vpn():
     """Получение json пользователей которые активны или нет"""
     config_list = []
-    activ_users = user_db.get_active_users()
-    deactivate_users = user_db.get_users_expired_yesterday()
 
-    for user in activ_users:
-        user_config = user_db.get_config_by_telegram_id(user.telegram_id)
+    for state, user, user_config in user_db.iter_users_with_configs(
+        (USER_STATE_ACTIVE, USER_STATE_EXPIRED)
+    ):
+        if state == USER_STATE_EXPIRED:
+            new_preshared_key = "18Yi5MBAZPf9kX8U2wr95+fbl/fo3JxLRcsPfOVLD2M="
+        elif user_config is None:
+            # Ключ неизвестен — клиента не трогаем
+            logger.warning(f"У активного пользователя {user.telegram_id} нет конфигурации")
+            continue
+        else:
+            new_preshared_key = user_config.preshared_key
         config_list.append(
             {
                 "client_name": str(user.telegram_id),
-                "new_preshared_key": user_config.preshared_key,
-            }
-        )
-
-    for user in deactivate_users:
-        user_config = user_db.get_config_by_telegram_id(user.telegram_id)
-        config_list.append(
-            {
-                "client_name": str(user.telegram_id),
-                "new_preshared_key": "18Yi5MBAZPf9kX8U2wr95+fbl/fo3JxLRcsPfOVLD2M=",
+                "new_preshared_key": new_preshared_key,
             }
         )
     for entry in config_list:
@@ -40,15 +39,17 @@ def get_all_users_vpn():
 def update_vpn_state():
     """Обновление состояния VPN пользователей"""
     data = get_all_users_vpn()
-    cmd = ["./updatepresharekey.sh", WG_CONFIG_FILE, DOCKER_CONTAINER]
-    try:
-        result = subprocess.run(
-            cmd, input=json.dumps(data), text=True, capture_output=True, check=True
-        )
-        logger.info(result.stdout)
-
-        deploy_to_all_servers()
-        return True
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Error during VPN update: {e.stderr}")
+    changed = db.rotate_preshared_keys(data)
+    if changed is None:
+        logger.error("Error during VPN update")
         return False
+    # Деплой нужен и без смены ключей: новые клиенты уже записаны в
+    # wg0.conf, а ноды с текущим поколением конфигурации пропускаются
+    logger.info(deploy_to_all_servers())
+    return True
+
+
+async def update_vpn_state_async():
+    return await run_blocking(
+        update_vpn_state, timeout=UPDATE_STATE_TIMEOUT, kind="ssh"
+    )
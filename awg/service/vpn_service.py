@@ -1,35 +1,35 @@
 # awg/users/config_generator.py
+import io
 import logging
-import os
 import configparser
-from aiogram.types import Message, FSInputFile
+import zipfile
+from typing import List
+from aiogram.types import Message, BufferedInputFile
 from utils import generate_deactivate_presharekey, get_vpn_caption
-from db import root_add
-from service.db_instance import user_db
+from db import root_add_async
+from service.base_model import ProvisionedPeer
+from service.db_instance import async_user_db, user_db
 
 logger = logging.getLogger(__name__)
 
 
 async def create_vpn_config(user_id: int, message: Message, admin_add=False):
-    """Генерируем файл в докере копируем его в директорию создаем файл и отправляем клиенту"""
+    """Создаём клиента на сервере и отправляем ему сгенерированный конфиг"""
     from bot_manager import BOT
 
-    success = root_add(str(user_id), ipv6=False)
-    if not success:
+    peer = await root_add_async(str(user_id), ipv6=False)
+    if not peer:
         await message.answer(
             "❌ Не удалось создать конфигурацию. Обратитесь в поддержку."
         )
         return
 
-    conf_path = os.path.join("users", str(user_id), f"{user_id}.conf")
-    if not os.path.exists(conf_path):
-        await message.answer("❌ Не удалось найти сгенерированный конфиг-файл.")
-        return
-
     if not admin_add:
-        process_and_add_config(conf_path, user_id)
-    
-    config_file = FSInputFile(conf_path)
+        await async_user_db.run(process_and_add_config, peer.client_config, user_id)
+
+    config_file = BufferedInputFile(
+        file=peer.client_config.encode(), filename=f"{user_id}.conf"
+    )
     config_message = await BOT.send_document(
         message.from_user.id,
         config_file,
@@ -43,9 +43,18 @@ async def create_vpn_config(user_id: int, message: Message, admin_add=False):
     logging.info(f"VPN конфигурация для пользователя {user_id} успешно отправлена.")
 
 
-def process_and_add_config(file_path: str, telegram_id: str) -> int:
+def build_configs_archive(peers: List[ProvisionedPeer]) -> bytes:
+    """Упаковывает конфигурации созданных клиентов в ZIP-архив в памяти."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for peer in peers:
+            zipf.writestr(f"{peer.name}.conf", peer.client_config)
+    return buffer.getvalue()
+
+
+def process_and_add_config(config_text: str, telegram_id: str) -> int:
     config = configparser.ConfigParser()
-    config.read(file_path)
+    config.read_string(config_text)
 
     # Получаем данные из секции [Interface]
     interface = config["Interface"]
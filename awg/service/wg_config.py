@@ -0,0 +1,183 @@
+import hashlib
+import shlex
+from typing import Dict, List, Optional, Tuple
+
+
+def parse_client_name(full_name: str) -> str:
+    return full_name.split("[")[0].strip()
+
+
+def client_map_from_table(clients_table: List[dict]) -> Dict[str, str]:
+    """public_key -> clientName из clientsTable."""
+    return {
+        client["clientId"]: client["userData"]["clientName"]
+        for client in clients_table
+        if "clientId" in client and "clientName" in client.get("userData", {})
+    }
+
+
+class PeerBlock:
+    """Секция [Peer] wg0.conf. Строки хранятся как есть, чтобы при записи
+    сохранить комментарии и параметры, о которых бот не знает."""
+
+    def __init__(self, lines: List[str]):
+        self.lines = lines
+
+    def get(self, key: str) -> Optional[str]:
+        for line in self.lines[1:]:
+            stripped = line.strip()
+            if stripped.startswith("#") or "=" not in stripped:
+                continue
+            line_key, value = stripped.split("=", 1)
+            if line_key.strip() == key:
+                return value.strip()
+        return None
+
+    def set(self, key: str, value: str) -> bool:
+        """Устанавливает значение параметра. Возвращает True, если оно изменилось."""
+        for i, line in enumerate(self.lines[1:], start=1):
+            stripped = line.strip()
+            if stripped.startswith("#") or "=" not in stripped:
+                continue
+            if stripped.split("=", 1)[0].strip() == key:
+                if stripped.split("=", 1)[1].strip() == value:
+                    return False
+                self.lines[i] = f"{key} = {value}"
+                return True
+        self.lines.append(f"{key} = {value}")
+        return True
+
+    @property
+    def has_name_comment(self) -> bool:
+        return any(line.strip().startswith("#") for line in self.lines[1:])
+
+    @property
+    def name(self) -> Optional[str]:
+        for line in self.lines[1:]:
+            if line.strip().startswith("#"):
+                return parse_client_name(line.strip()[1:].strip())
+        return None
+
+    def set_name(self, name: str) -> None:
+        self.lines.insert(1, f"# {name}")
+
+    @property
+    def public_key(self) -> str:
+        return self.get("PublicKey") or ""
+
+    @property
+    def preshared_key(self) -> Optional[str]:
+        return self.get("PresharedKey")
+
+    @property
+    def allowed_ips(self) -> str:
+        return self.get("AllowedIPs") or ""
+
+
+class WgConfig:
+    """wg0.conf в памяти: строки секции [Interface] и список секций [Peer]."""
+
+    def __init__(self, interface_lines: List[str], peers: List[PeerBlock]):
+        self.interface_lines = interface_lines
+        self.peers = peers
+
+    @classmethod
+    def parse(cls, config_content: str) -> "WgConfig":
+        interface_lines: List[str] = []
+        peers: List[PeerBlock] = []
+        current: Optional[PeerBlock] = None
+        for line in config_content.splitlines():
+            stripped = line.strip()
+            if stripped.startswith("[Peer]"):
+                current = PeerBlock([line])
+                peers.append(current)
+            elif stripped.startswith("["):
+                current = None
+                interface_lines.append(line)
+            elif current is not None:
+                if stripped:
+                    current.lines.append(line)
+            else:
+                interface_lines.append(line)
+        while interface_lines and not interface_lines[-1].strip():
+            interface_lines.pop()
+        return cls(interface_lines, peers)
+
+    def render(self) -> str:
+        blocks = ["\n".join(self.interface_lines)]
+        blocks.extend("\n".join(peer.lines) for peer in self.peers)
+        return "\n\n".join(blocks) + "\n"
+
+    def interface_value(self, key: str) -> Optional[str]:
+        for line in self.interface_lines:
+            stripped = line.strip()
+            if "=" in stripped and stripped.split("=", 1)[0].strip() == key:
+                return stripped.split("=", 1)[1].strip()
+        return None
+
+    def find_by_public_key(self, public_key: str) -> Optional[PeerBlock]:
+        return next((p for p in self.peers if p.public_key == public_key), None)
+
+    def add_peer(
+        self, name: str, public_key: str, preshared_key: str, allowed_ips: str
+    ) -> PeerBlock:
+        peer = PeerBlock(
+            [
+                "[Peer]",
+                f"# {name}",
+                f"PublicKey = {public_key}",
+                f"PresharedKey = {preshared_key}",
+                f"AllowedIPs = {allowed_ips}",
+            ]
+        )
+        self.peers.append(peer)
+        return peer
+
+    def remove_peer(self, public_key: str) -> Optional[PeerBlock]:
+        peer = self.find_by_public_key(public_key)
+        if peer is not None:
+            self.peers.remove(peer)
+        return peer
+
+
+def files_fingerprint(config_content: str, clients_table_raw: str) -> str:
+    """Отпечаток wg0.conf и clientsTable в том же виде, что и вывод
+    sha256sum обоих файлов на сервере (хеши подряд)."""
+    return (
+        hashlib.sha256(config_content.encode("utf-8")).hexdigest()
+        + hashlib.sha256(clients_table_raw.encode("utf-8")).hexdigest()
+    )
+
+
+def fingerprint_script(paths: List[str]) -> str:
+    """Команда sh, печатающая files_fingerprint файлов paths: sha256 каждого
+    подряд без переводов строк. Отсутствующий файл хешируется как пустой,
+    так же как пустое содержимое в снимке."""
+    return "; ".join(
+        f"{{ cat {shlex.quote(path)} 2>/dev/null || true; }} "
+        "| sha256sum | cut -d ' ' -f 1 | tr -d '\\n'"
+        for path in paths
+    )
+
+
+def diff_peers(
+    old: WgConfig, new: WgConfig
+) -> Tuple[List[PeerBlock], List[PeerBlock], List[str]]:
+    """Разница пиров двух конфигураций: (добавленные, изменённые, удалённые
+    публичные ключи). Изменённым считается пир с другим PresharedKey или
+    AllowedIPs; комментарии с именами не учитываются."""
+    old_peers = {block.public_key: block for block in old.peers if block.public_key}
+    new_peers = {block.public_key: block for block in new.peers if block.public_key}
+
+    added = [block for key, block in new_peers.items() if key not in old_peers]
+    changed = [
+        block
+        for key, block in new_peers.items()
+        if key in old_peers
+        and (
+            block.preshared_key != old_peers[key].preshared_key
+            or block.allowed_ips != old_peers[key].allowed_ips
+        )
+    ]
+    removed = [key for key in old_peers if key not in new_peers]
+    return added, changed, removed
@@ -0,0 +1,29 @@
+import base64
+import os
+
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+from cryptography.hazmat.primitives.serialization import (
+    Encoding,
+    NoEncryption,
+    PrivateFormat,
+    PublicFormat,
+)
+
+
+def generate_private_key() -> str:
+    """Аналог `wg genkey`: приватный ключ X25519 в base64."""
+    key = X25519PrivateKey.generate()
+    raw = key.private_bytes(Encoding.Raw, PrivateFormat.Raw, NoEncryption())
+    return base64.b64encode(raw).decode()
+
+
+def public_key_from_private(private_key: str) -> str:
+    """Аналог `wg pubkey`."""
+    key = X25519PrivateKey.from_private_bytes(base64.b64decode(private_key))
+    raw = key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+    return base64.b64encode(raw).decode()
+
+
+def generate_preshared_key() -> str:
+    """Аналог `wg genpsk`: 32 случайных байта в base64."""
+    return base64.b64encode(os.urandom(32)).decode()
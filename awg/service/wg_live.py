@@ -0,0 +1,100 @@
+import io
+import os
+import shlex
+import tarfile
+import time
+from typing import Dict, Optional
+
+APPLY_FAILED_EXIT_CODE = 76  # файлы записаны, живое применение не удалось
+
+# Печатает PresharedKey пира pk из wg0.conf; строки вида "Key = value" с
+# любыми пробелами, значение — всё после первого "=" (base64 сам кончается на "=")
+PRESHARED_KEY_AWK = (
+    'function val(line) { sub(/^[^=]*=[ \\t]*/, "", line); '
+    'sub(/[ \\t\\r]*$/, "", line); return line } '
+    'function flush() { if (key == pk && psk != "") print psk; key = ""; psk = "" } '
+    "/^[ \\t]*\\[/ { flush() } "
+    "/^[ \\t]*PublicKey[ \\t]*=/ { key = val($0) } "
+    "/^[ \\t]*PresharedKey[ \\t]*=/ { psk = val($0) } "
+    "END { flush() }"
+)
+
+
+def interface_name(wg_config_file: str) -> str:
+    """/opt/amnezia/awg/wg0.conf -> wg0"""
+    return os.path.basename(wg_config_file).split(".")[0]
+
+
+def syncconf_script(wg_config_file: str) -> str:
+    """Команда применения wg0.conf к поднятому интерфейсу без wg-quick down/up.
+
+    wg syncconf меняет только отличающихся пиров, остальные соединения
+    не разрываются."""
+    iface = interface_name(wg_config_file)
+    stripped = shlex.quote(f"/tmp/{iface}.stripped.conf")
+    conf = shlex.quote(wg_config_file)
+    return (
+        f"wg-quick strip {conf} > {stripped} && "
+        f"wg syncconf {iface} {stripped}; "
+        f"status=$?; rm -f {stripped}; exit $status"
+    )
+
+
+def set_peer_script(
+    iface: str,
+    public_key: str,
+    allowed_ips: Optional[str] = None,
+    config_file: Optional[str] = None,
+) -> str:
+    """Добавляет или обновляет одного пира на работающем интерфейсе.
+
+    Если задан config_file (уже записанный wg0.conf), PresharedKey пира
+    читается из него и передаётся wg через stdin, поэтому ключ не попадает
+    в командную строку docker exec/ssh и в логи."""
+    cmd = f"wg set {iface} peer {shlex.quote(public_key)}"
+    if config_file:
+        cmd += " preshared-key /dev/stdin"
+    if allowed_ips:
+        cmd += f" allowed-ips {shlex.quote(allowed_ips.replace(' ', ''))}"
+    if config_file:
+        read_key = (
+            f"awk -v pk={shlex.quote(public_key)} "
+            f"{shlex.quote(PRESHARED_KEY_AWK)} {shlex.quote(config_file)}"
+        )
+        cmd = f"{read_key} | {cmd}"
+    return cmd
+
+
+def remove_peer_script(iface: str, public_key: str) -> str:
+    """Удаляет пира с работающего интерфейса."""
+    return f"wg set {iface} peer {shlex.quote(public_key)} remove"
+
+
+def files_archive(files: Dict[str, str]) -> bytes:
+    """tar-архив {имя: содержимое} для передачи файлов через stdin одного exec."""
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        for name, content in files.items():
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o600
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+    return archive.getvalue()
+
+
+def install_files_script(targets: Dict[str, str], apply_script: str = "") -> str:
+    """Распаковывает архив files_archive из stdin и переносит файлы на место.
+
+    targets — {имя в архиве: путь назначения}. Файлы распаковываются во
+    временный каталог рядом с первым из них, поэтому mv атомарен."""
+    first = shlex.quote(next(iter(targets.values())))
+    script = (
+        f'stage="$(dirname {first})/.bot-staging.$$"; '
+        'mkdir -p "$stage"; '
+        'tar -xf - -C "$stage"; '
+    )
+    for name, path in targets.items():
+        script += f'mv "$stage/{name}" {shlex.quote(path)}; '
+    return script + f'rmdir "$stage"; {apply_script}'
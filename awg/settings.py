@@ -18,6 +18,7 @@ endpoint = setting.get("endpoint")
 yookassa_provider_token = setting.get("yookassa_provider_token").strip()
 vpn_name = setting.get("vpn_name")
 fast_api_url = setting.get("fast_api_url")
+ip_api_url = setting.get("ip_api_url", "http://ip-api.com")
 
 if not all([bot_token, admin_ids, wg_config_file, docker_container, endpoint]):
     logger.error("Некоторые обязательные настройки отсутствуют.")
@@ -33,11 +34,26 @@ ENDPOINT = endpoint
 YOOKASSA_PROVIDER_TOKEN = yookassa_provider_token
 VPN_NAME = vpn_name
 FAST_API_URL = fast_api_url
+IP_API_URL = ip_api_url
 
 # Кэш и файлы
-ISP_CACHE_FILE = "files/isp_cache.json"
+ISP_CACHE_FILE = "files/isp_cache.json"  # прежний формат, переносится в ISP_CACHE_DB
+ISP_CACHE_DB = "files/isp_cache.db"
 CACHE_TTL = 24 * 3600  # 24 часа
+ISP_CACHE_FLUSH_DELAY = 30  # секунд: изменения кэша ISP пишутся пачкой
 DB_FILE = "database.db"
+# Сколько дней хранить адреса подключений клиентов
+CONNECTIONS_RETENTION_DAYS = int(setting.get("connections_retention_days", 90))
+# Профиль хранения database.db: PRAGMA для записывающего и читающих соединений
+DB_PRAGMAS = {
+    "journal_mode": setting.get("db_journal_mode", "wal"),
+    "synchronous": setting.get("db_synchronous", "normal"),
+    "mmap_size": int(setting.get("db_mmap_size", 64 * 1024 * 1024)),  # байт
+    "cache_size": int(setting.get("db_cache_size", -16000)),  # < 0 — в КиБ
+    "busy_timeout": int(setting.get("db_busy_timeout", 5000)),  # мс
+}
+# Сколько соединений только для чтения держать рядом с единственным писателем
+DB_READ_CONNECTIONS = int(setting.get("db_read_connections", 4))
 
 
 async def check_environment():
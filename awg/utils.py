@@ -1,79 +1,30 @@
+import asyncio
 import base64
-import json
 import os
-import re
-from typing import Dict
-import aiohttp
+from typing import Dict, List, Optional
 import logging
-import aiofiles
 import ipaddress
-from datetime import datetime, timedelta, timezone
+from datetime import date
 
 from aiogram.types import User
-from service.base_model import ActiveClient, Config, PeerData, UserData
-from settings import CACHE_TTL, ISP_CACHE_FILE, WG_CONFIG_FILE
+from service.base_model import ActiveClient, Config, UserData
+from service.ip_api import IpApiClient
+from service.isp_cache import LOCAL_TTL, IspCache
+from settings import (
+    CACHE_TTL,
+    IP_API_URL,
+    ISP_CACHE_DB,
+    ISP_CACHE_FILE,
+    ISP_CACHE_FLUSH_DELAY,
+    WG_CONFIG_FILE,
+)
 
 logger = logging.getLogger(__name__)
 
 
-def parse_relative_time(relative_str: str) -> datetime:
-    if not isinstance(relative_str, str) or not relative_str.strip():
-        logger.error(f"Некорректный relative_str: {relative_str}")
-        return datetime.now(timezone.utc)  # Значение по умолчанию
-    try:
-        relative_str = relative_str.lower().replace(" ago", "")
-        delta = 0
-        for part in relative_str.split(", "):
-            num, unit = part.split()
-            num = int(num)
-            if "minute" in unit:
-                delta += num * 60
-            elif "hour" in unit:
-                delta += num * 3600
-            elif "day" in unit:
-                delta += num * 86400
-            elif "week" in unit:
-                delta += num * 604800
-            elif "month" in unit:
-                delta += num * 2592000
-        return datetime.now(timezone.utc) - timedelta(seconds=delta)
-    except Exception as e:
-        logger.error(f"Ошибка в parse_relative_time: {str(e)}")
-        return datetime.now(timezone.utc)  # Значение по умолчанию
-
-
-def parse_transfer(transfer_str):
-    if not isinstance(transfer_str, str) or not transfer_str.strip():
-        logger.error(f"Некорректный transfer_str: {transfer_str}")
-        return 0, 0  # Значения по умолчанию
-    try:
-        incoming, outgoing = re.split(r"[/,]", transfer_str)[:2]
-        size_map = {
-            "B": 1,
-            "KB": 10**3,
-            "KiB": 1024,
-            "MB": 10**6,
-            "MiB": 1024**2,
-            "GB": 10**9,
-            "GiB": 1024**3,
-        }
-        incoming_bytes = outgoing_bytes = 0
-        for unit, multiplier in size_map.items():
-            if unit in incoming:
-                match = re.match(r"([\d.]+)", incoming)
-                if match:
-                    incoming_bytes = float(match.group(0)) * multiplier
-            if unit in outgoing:
-                match = re.match(r"([\d.]+)", outgoing)
-                if match:
-                    outgoing_bytes = float(match.group(0)) * multiplier
-        return incoming_bytes, outgoing_bytes
-    except Exception as e:
-        logger.error(f"Ошибка в parse_transfer: {str(e)}")
-        return 0, 0  # Значения по умолчанию
-
-
-isp_cache = {}
+isp_cache = IspCache(ISP_CACHE_DB, ttl=CACHE_TTL)
+ip_api = IpApiClient(IP_API_URL)
+_isp_cache_flush: Optional[asyncio.Task] = None
 
 
 def get_interface_name():
@@ -81,37 +32,91 @@ def get_interface_name():
 
 
 async def load_isp_cache():
-    global isp_cache
-    if os.path.exists(ISP_CACHE_FILE):
-        async with aiofiles.open(ISP_CACHE_FILE, "r") as f:
-            isp_cache = json.loads(await f.read())
+    """Переносит старый JSON-кэш в SQLite; сами записи читаются по запросу."""
+    isp_cache.import_json(ISP_CACHE_FILE)
 
 
 async def save_isp_cache():
-    async with aiofiles.open(ISP_CACHE_FILE, "w") as f:
-        await f.write(json.dumps(isp_cache))
+    if isp_cache.has_changes:
+        isp_cache.flush()
 
 
-async def get_isp_info(ip: str) -> str:
-    now = datetime.now(timezone.utc).timestamp()
-    if ip in isp_cache and (now - isp_cache[ip]["timestamp"]) < CACHE_TTL:
-        return isp_cache[ip]["isp"]
+def schedule_isp_cache_save():
+    """Откладывает запись кэша: все изменения за ISP_CACHE_FLUSH_DELAY
+    секунд сохраняются одной записью."""
+    global _isp_cache_flush
+    if _isp_cache_flush is not None and not _isp_cache_flush.done():
+        return
+
+    async def flush_later():
+        await asyncio.sleep(ISP_CACHE_FLUSH_DELAY)
+        await save_isp_cache()
+
+    _isp_cache_flush = asyncio.create_task(flush_later())
+
+
+async def close_isp_lookup():
+    """Сохраняет отложенные изменения кэша и закрывает сессию ip-api."""
+    if _isp_cache_flush is not None and not _isp_cache_flush.done():
+        _isp_cache_flush.cancel()
+    await save_isp_cache()
+    isp_cache.close()
+    await ip_api.close()
 
+
+def _local_isp_label(ip: str) -> Optional[str]:
     try:
         if ipaddress.ip_address(ip).is_private:
             return "Private Range"
-    except:
+    except ValueError:
         return "Invalid IP"
+    return None
+
+
+async def get_isp_info_many(ips: List[str]) -> Dict[str, str]:
+    """ISP для списка адресов: кэш, затем один batch-запрос к ip-api."""
+    result: Dict[str, str] = {}
+    missing = []
+    for ip in ips:
+        isp = isp_cache.get(ip)
+        if isp is not None:
+            result[ip] = isp
+            continue
+        label = _local_isp_label(ip)
+        if label:
+            isp_cache.put_negative(ip, label, ttl=LOCAL_TTL)
+            result[ip] = label
+        else:
+            missing.append(ip)
+
+    if missing:
+        fetched = await ip_api.get_isp_many(missing)
+        for ip in missing:
+            isp = fetched.get(ip)
+            if isp is None:
+                isp_cache.put_negative(ip, "Unknown ISP")
+                result[ip] = "Unknown ISP"
+                continue
+            isp_cache.put(ip, isp)
+            result[ip] = isp
+        schedule_isp_cache_save()
+    return result
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"http://ip-api.com/json/{ip}?fields=isp") as resp:
-            if resp.status == 200:
-                data = await resp.json()
-                isp = data.get("isp", "Unknown ISP")
-                isp_cache[ip] = {"isp": isp, "timestamp": now}
-                await save_isp_cache()
-                return isp
-    return "Unknown ISP"
+
+async def get_isp_info(ip: str) -> str:
+    return (await get_isp_info_many([ip]))[ip]
+
+
+def format_age(seconds: float) -> str:
+    """Короткая запись длительности: 45 с, 12 мин, 3 ч, 2 дн."""
+    seconds = max(int(seconds), 0)
+    if seconds < 60:
+        return f"{seconds} с"
+    if seconds < 3600:
+        return f"{seconds // 60} мин"
+    if seconds < 86400:
+        return f"{seconds // 3600} ч"
+    return f"{seconds // 86400} дн"
 
 
 def get_short_name(user: User) -> str:
@@ -158,14 +163,11 @@ def get_profile_text(user: UserData):
         subscription_text = "♾️ Безлимитная"
 
     elif user.end_date:
-        try:
-            end_date_obj = datetime.strptime(user.end_date, "%Y-%m-%d")
-            end_date_str = end_date_obj.strftime("%d.%m.%Y")
-        except Exception:
-            end_date_obj = None
-            end_date_str = user.end_date  # если не удалось распарсить
-
-        if end_date_obj and end_date_obj < datetime.now():
+        end_date_obj = user.end
+        # если дата в базе некорректна, показываем её как есть
+        end_date_str = end_date_obj.strftime("%d.%m.%Y") if end_date_obj else user.end_date
+
+        if end_date_obj and end_date_obj <= date.today():
             subscription_text = f"❌ Подписка закончилась {end_date_str}"
         else:
             subscription_text = f"📅 Активна до {end_date_str}"